@@ -1,8 +1,187 @@
 import logging
-from os import makedirs
+from collections.abc import Mapping, Sequence
+from functools import lru_cache
+from itertools import islice
+from os import makedirs, path
 
+import numpy as np
 from gensim.models.word2vec import Word2Vec
-from typing import Union
+from typing import Iterable, Iterator, Union
+
+from levelwise_model.clustering import get_clustering_method
+from levelwise_model.corpus import TokenIdCache
+from levelwise_model.neighbours import get_neighbour_index
+
+
+@lru_cache(maxsize=None)
+def _alpha_codepoints() -> np.ndarray:
+    return np.array(
+        [
+            codepoint for codepoint in range(0x0021, 0x110000)
+            if chr(codepoint).isalpha()
+        ],
+        dtype=np.uint32
+    )
+
+
+def get_key_codepoints(
+        n_clusters: int,
+        after: int = None
+) -> np.ndarray:
+    """
+    Returns the codepoints of the keys of the first `n_clusters`
+    clusters. Keys are the alphabetic characters from U+0021 upwards,
+    in order. If `after` is given, keys start after that codepoint.
+    """
+    codepoints = _alpha_codepoints()
+    if after is not None:
+        codepoints = codepoints[
+            np.searchsorted(codepoints, after, side="right"):
+        ]
+    if n_clusters > len(codepoints):
+        raise ValueError(
+            f"Cannot create more than {len(codepoints)} clusters."
+        )
+    return codepoints[:n_clusters]
+
+
+def codepoints_to_text(codepoints: np.ndarray) -> str:
+    """
+    Decodes an array of codepoints into a string.
+    """
+    return codepoints.astype("<u4").tobytes().decode("utf-32-le")
+
+
+def _iter_chunks(
+        items: Iterable,
+        size: int
+) -> Iterator[list]:
+    items = iter(items)
+    chunk = list(islice(items, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(items, size))
+
+
+def _binary_prefix(map_file: str) -> str:
+    return map_file[:-4] if map_file.endswith(".txt") else map_file
+
+
+class StringTable(Sequence):
+    """
+    Read-only table of strings stored as one UTF-8 buffer and the
+    offset of every string in it. Strings must be sorted for `find`.
+    """
+    def __init__(
+            self,
+            buffer: np.ndarray,
+            offsets: np.ndarray
+    ):
+        self.buffer = buffer
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(
+            self,
+            idx: int
+    ) -> str:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        return self.buffer[
+            self.offsets[idx]:self.offsets[idx + 1]
+        ].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        data = self.buffer.tobytes()
+        for start, end in zip(self.offsets[:-1], self.offsets[1:]):
+            yield data[start:end].decode("utf-8")
+
+    def find(
+            self,
+            string: str
+    ) -> int:
+        """
+        Returns the index of a string by binary search, -1 if absent.
+        """
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self[middle] < string:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self) and self[low] == string:
+            return low
+        return -1
+
+
+class WordToClusterView(Mapping):
+    """
+    Read-only word to cluster key mapping over the arrays of a
+    memory-mapped `Cluster`.
+    """
+    def __init__(self, cluster: "Cluster"):
+        self.cluster = cluster
+
+    def __getitem__(
+            self,
+            word: str
+    ) -> str:
+        idx = self.cluster.words.find(word)
+        if idx == -1 or self.cluster.cluster_ids[idx] == -1:
+            raise KeyError(word)
+        return chr(self.cluster.cluster_keys[self.cluster.cluster_ids[idx]])
+
+    def __iter__(self):
+        for word, cluster_id in zip(
+            self.cluster.words, self.cluster.cluster_ids
+        ):
+            if cluster_id != -1:
+                yield word
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.cluster.cluster_ids != -1))
+
+
+class ClusterToWordsView(Mapping):
+    """
+    Read-only cluster key to words mapping over the arrays of a
+    memory-mapped `Cluster`.
+    """
+    def __init__(self, cluster: "Cluster"):
+        self.cluster = cluster
+        self._cluster_index = None
+
+    def __getitem__(
+            self,
+            key: str
+    ) -> list[str]:
+        if self._cluster_index is None:
+            self._cluster_index = {
+                chr(codepoint): cluster_id
+                for cluster_id, codepoint in enumerate(
+                    self.cluster.cluster_keys
+                )
+            }
+        cluster_id = self._cluster_index[key]
+        return [
+            self.cluster.words[word]
+            for word in self.cluster.members[
+                self.cluster.member_offsets[cluster_id]:
+                self.cluster.member_offsets[cluster_id + 1]
+            ]
+        ]
+
+    def __iter__(self):
+        for codepoint in self.cluster.cluster_keys:
+            yield chr(codepoint)
+
+    def __len__(self) -> int:
+        return len(self.cluster.cluster_keys)
 
 
 class Cluster:
@@ -11,8 +190,42 @@ class Cluster:
             threshold: float = None,
             model: Union[str, Word2Vec] = None,
             map_file: str = None,
-            log_dir: str = None
+            log_dir: str = None,
+            index: str = "exact",
+            index_args: dict = None,
+            method: str = "greedy",
+            method_args: dict = None,
+            previous_model: Word2Vec = None,
+            tolerance: float = 0.05
     ):
+        """
+        Inputs
+        ------
+            threshold : float, OPTIONAL
+                Similarity above which words join a cluster.
+            model : Word2Vec, OPTIONAL
+                Model to cluster the vocabulary of.
+            map_file : str, OPTIONAL
+                Mapping to load instead of clustering a model.
+            log_dir : str, OPTIONAL
+                Directory to write logs to.
+            index : str, OPTIONAL
+                Neighbour search backend, "exact" or "ivf".
+                (default = "exact")
+            index_args : dict, OPTIONAL
+                Keyword arguments of the neighbour index.
+            method : str, OPTIONAL
+                Clustering method, "greedy", "kmeans", "components" or
+                "agglomerative". (default = "greedy")
+            method_args : dict, OPTIONAL
+                Keyword arguments of the clustering method.
+            previous_model : Word2Vec, OPTIONAL
+                Model the mapping in `map_file` was created from. If
+                given with `model` and `threshold`, the mapping is
+                updated with `update_clusters` instead of recreated.
+            tolerance : float, OPTIONAL
+                See `update_clusters`. (default = 0.05)
+        """
         self.log_dir = log_dir
         self.logger = logging.getLogger("Cluster")
         self.logger.setLevel("DEBUG")
@@ -36,7 +249,27 @@ class Cluster:
         self.cluster_to_words = dict()
         self.word_to_cluster = dict()
 
-        if model is not None and threshold is not None:
+        # Words by index, the cluster id of every word (-1 if it has
+        # none) and the codepoint of the key of every cluster id
+        self.words = []
+        self.cluster_ids = np.zeros(0, dtype=np.int32)
+        self.cluster_keys = np.zeros(0, dtype=np.uint32)
+        # Word indices of every cluster, in the order they were added
+        self.members = np.zeros(0, dtype=np.int32)
+        self.member_offsets = np.zeros(1, dtype=np.int64)
+
+        self.index = index
+        self.index_args = index_args or {}
+        # Recall of an approximate index against exact search
+        self.index_recall = None
+        self.method = method
+        self.method_args = method_args or {}
+
+        if model is not None and threshold is not None \
+                and map_file is not None and previous_model is not None:
+            self.load_mapping(map_file)
+            self.update_clusters(model, previous_model, threshold, tolerance)
+        elif model is not None and threshold is not None:
             self.create_clusters_from_model(model, threshold)
         elif map_file is not None:
             self.load_mapping(map_file)
@@ -44,54 +277,420 @@ class Cluster:
     def create_clusters_from_model(
             self,
             model: Word2Vec,
-            threshold: float
+            threshold: float,
+            block_size: int = 1024
     ):
-        words = list(model.wv.key_to_index.keys())
-
-        cluster_idx = 0  # Counter
-
-        for word in words:
-            # Check if word has already been clustered
-            if word not in self.word_to_cluster.keys():
-                # Create new cluster
-                cluster_idx += 1
-                while (not chr(0x0020 + cluster_idx).isalpha()) or \
-                        len(chr(0x0020 + cluster_idx)) > 1:
-                    cluster_idx += 1
-                cluster_key = chr(0x0020 + cluster_idx)
-
-                # Add new word to cluster
-                self.cluster_to_words[cluster_key] = [word]
-                self.word_to_cluster[word] = cluster_key
-
-                # Add all similar words
-                for similar_word, score in model.wv.most_similar(
-                    word, topn=200
-                ):
-                    if score > threshold:
-                        self.cluster_to_words[cluster_key].append(similar_word)
-                        self.word_to_cluster[similar_word] = cluster_key
+        """
+        Clusters the vocabulary with the configured clustering method.
+        Words are assigned to clusters in the order the method returns
+        them, so a word listed in several clusters ends up in the last.
+
+        Neighbours are searched with the configured neighbour index,
+        for blocks of `block_size` query words at once.
+        """
+        self.words = list(model.wv.index_to_key)
+        vectors = model.wv.get_normed_vectors()
+        self.cluster_ids = np.full(len(self.words), -1, dtype=np.int32)
 
+        index_args = dict(self.index_args)
+        if self.index == "exact":
+            index_args.setdefault("block_size", block_size)
+        neighbour_index = get_neighbour_index(
+            self.index, vectors, keys=self.words, **index_args
+        )
+        if self.index != "exact" and self.method != "kmeans":
+            self.index_recall = neighbour_index.recall()
+            self.logger.info(
+                f"Neighbour index recall@10 - {self.index_recall:.4f}."
+            )
+
+        method_args = dict(self.method_args)
+        if self.method != "kmeans":
+            method_args.setdefault("block_size", block_size)
+        members = get_clustering_method(self.method)(
+            vectors, threshold, neighbour_index, **method_args
+        )
+        for cluster_id, cluster_members in enumerate(members):
+            self.cluster_ids[cluster_members] = cluster_id
+
+        self.cluster_keys = get_key_codepoints(len(members))
+        self._set_members(members)
+        self._build_views()
         self.logger.info(f"Created {len(self.cluster_to_words)} clusters.")
 
+    def update_clusters(
+            self,
+            model: Word2Vec,
+            previous_model: Word2Vec,
+            threshold: float,
+            tolerance: float = 0.05,
+            topn: int = 200,
+            block_size: int = 1024
+    ):
+        """
+        Updates a loaded mapping for a model that continued training
+        from `previous_model`, instead of clustering it from scratch.
+
+        Words whose vectors moved by a cosine distance of at most
+        `tolerance` keep their cluster and its key. Only new words and
+        words that moved further are re-evaluated. In vocabulary
+        order, each of them joins the cluster of its most similar
+        clustered word scoring above `threshold` or, if there is none,
+        starts a new cluster with its unclustered words above
+        `threshold`. New clusters get keys after the existing ones.
+        Clusters left empty are dropped, the others keep their keys.
+
+        Inputs
+        ------
+            model : Word2Vec
+                Updated model.
+            previous_model : Word2Vec
+                Model the loaded mapping was created from.
+            threshold : float
+                Similarity above which words join a cluster.
+            tolerance : float, OPTIONAL
+                Cosine distance a word's vector may move by before it
+                is re-evaluated. (default = 0.05)
+            topn : int, OPTIONAL
+                Number of neighbours searched per word.
+                (default = 200)
+            block_size : int, OPTIONAL
+                Number of words searched at once. (default = 1024)
+        """
+        words = list(model.wv.index_to_key)
+        vectors = model.wv.get_normed_vectors()
+        cluster_ids = np.full(len(words), -1, dtype=np.int32)
+
+        # Words clustered before that are in both models
+        old_ids = np.asarray(self.cluster_ids)
+        old_index = {word: idx for idx, word in enumerate(self.words)}
+        common = np.array(
+            [
+                (idx, old_index[word], previous_model.wv.key_to_index[word])
+                for idx, word in enumerate(words)
+                if word in old_index
+                and word in previous_model.wv.key_to_index
+                and old_ids[old_index[word]] != -1
+            ],
+            dtype=np.int64
+        ).reshape(-1, 3)
+        rows, old_rows, previous_rows = common.T
+
+        # Words that moved less than the tolerance keep their cluster
+        moved = 1 - np.einsum(
+            "ij,ij->i",
+            vectors[rows],
+            previous_model.wv.get_normed_vectors()[previous_rows]
+        )
+        stable = moved <= tolerance
+        cluster_ids[rows[stable]] = old_ids[old_rows[stable]]
+
+        old_to_new = np.full(len(old_index), -1, dtype=np.int64)
+        old_to_new[old_rows[stable]] = rows[stable]
+        members = []
+        for cluster_id in range(len(self.cluster_keys)):
+            cluster_members = old_to_new[
+                self.members[
+                    self.member_offsets[cluster_id]:
+                    self.member_offsets[cluster_id + 1]
+                ]
+            ]
+            members.append([
+                word for word in cluster_members.tolist()
+                if word != -1 and cluster_ids[word] == cluster_id
+            ])
+        n_previous = len(members)
+
+        dirty = np.flatnonzero(cluster_ids == -1)
+        self.logger.info(
+            f"Re-evaluating {len(dirty)} of {len(words)} words."
+        )
+
+        index_args = dict(self.index_args)
+        if self.index == "exact":
+            index_args.setdefault("block_size", block_size)
+        neighbour_index = get_neighbour_index(
+            self.index, vectors, keys=words, **index_args
+        )
+
+        for block_start in range(0, len(dirty), block_size):
+            block = dirty[block_start:block_start + block_size]
+            indices, scores = neighbour_index.search(vectors[block], topn + 1)
+
+            for row, row_indices, row_scores in zip(block, indices, scores):
+                if cluster_ids[row] != -1:
+                    continue
+
+                found = (row_indices != row) & (row_indices != -1)
+                row_indices = row_indices[found][:topn]
+                neighbours = row_indices[row_scores[found][:topn] > threshold]
+
+                clustered = neighbours[cluster_ids[neighbours] != -1]
+                if len(clustered):
+                    cluster_ids[row] = cluster_ids[clustered[0]]
+                    members[cluster_ids[row]].append(row)
+                else:
+                    cluster_ids[row] = len(members)
+                    cluster_ids[neighbours] = len(members)
+                    members.append([row] + neighbours.tolist())
+
+        # Drop empty clusters, keeping the keys of the others
+        keys = np.concatenate([
+            np.asarray(self.cluster_keys, dtype=np.uint32),
+            get_key_codepoints(
+                len(members) - n_previous,
+                after=int(np.max(self.cluster_keys, initial=0))
+            )
+        ])
+        kept = np.array(
+            [cluster_id for cluster_id, cluster_members in enumerate(members)
+             if cluster_members],
+            dtype=np.int64
+        )
+        # The extra last entry maps unclustered words (-1) to -1
+        new_ids = np.full(len(members) + 1, -1, dtype=np.int32)
+        new_ids[kept] = np.arange(len(kept), dtype=np.int32)
+
+        self.words = words
+        self.cluster_ids = new_ids[cluster_ids]
+        self.cluster_keys = keys[kept]
+        self._set_members([members[cluster_id] for cluster_id in kept])
+        self._build_views()
+        self.logger.info(
+            f"Kept {np.count_nonzero(kept < n_previous)} clusters and "
+            f"created {np.count_nonzero(kept >= n_previous)}."
+        )
+
+    def _set_members(
+            self,
+            members: list[list[int]]
+    ) -> None:
+        self.members = np.array(
+            [word for cluster_members in members for word in cluster_members],
+            dtype=np.int32
+        )
+        self.member_offsets = np.concatenate([
+            [0],
+            np.cumsum([len(cluster_members) for cluster_members in members])
+        ]).astype(np.int64)
+
+    def _build_views(self) -> None:
+        """
+        Builds the `cluster_to_words` and `word_to_cluster` dicts from
+        the cluster id arrays.
+        """
+        keys = [chr(key) for key in self.cluster_keys]
+        self.cluster_to_words = {
+            keys[cluster_id]: [
+                self.words[word]
+                for word in self.members[
+                    self.member_offsets[cluster_id]:
+                    self.member_offsets[cluster_id + 1]
+                ]
+            ]
+            for cluster_id in range(len(keys))
+        }
+        self.word_to_cluster = {
+            word: keys[cluster_id]
+            for word, cluster_id in zip(self.words, self.cluster_ids)
+            if cluster_id != -1
+        }
+
     def load_mapping(
             self,
             map_file: str
     ) -> None:
+        """
+        Loads a mapping saved by `save_mapping`. The binary copy is
+        used when it exists and is not older than the text file.
+        """
+        prefix = _binary_prefix(map_file)
+        if path.isfile(f"{prefix}.ids.npy") and (
+            not path.isfile(map_file)
+            or path.getmtime(f"{prefix}.ids.npy") >= path.getmtime(map_file)
+        ):
+            self.load_binary(prefix)
+            return
+
+        keys = []
+        members = []
+        word_index = {}
         with open(map_file, "r", encoding="utf-8") as map_fp:
             for line in map_fp.readlines():
                 if line.strip():
                     cluster, words = line.strip().split("\t")
-                    words = words.split(",")
-                    self.cluster_to_words[cluster] = words
-                    for word in words:
-                        self.word_to_cluster[word] = cluster
+                    keys.append(ord(cluster))
+                    cluster_members = []
+                    for word in words.split(","):
+                        if word not in word_index:
+                            word_index[word] = len(word_index)
+                        cluster_members.append(word_index[word])
+                    members.append(cluster_members)
+
+        self.words = list(word_index)
+        self.cluster_keys = np.array(keys, dtype=np.uint32)
+        self.cluster_ids = np.full(len(self.words), -1, dtype=np.int32)
+        for cluster_id, cluster_members in enumerate(members):
+            self.cluster_ids[cluster_members] = cluster_id
+        self._set_members(members)
+        self._build_views()
+
+    def save_binary(
+            self,
+            prefix: str
+    ) -> None:
+        """
+        Saves the mapping as memory-mappable arrays, each in a
+        `{prefix}.{name}.npy` file:
+            vocab, offsets : UTF-8 bytes of the words sorted by bytes,
+                and the offset of every word in them.
+            ids : cluster id of every word, -1 if it has none.
+            keys : codepoint of the key of every cluster id.
+            members, member_offsets : word indices of every cluster.
+        """
+        encoded = [word.encode("utf-8") for word in self.words]
+        order = sorted(range(len(encoded)), key=encoded.__getitem__)
+        rank = np.empty(len(order), dtype=np.int32)
+        rank[order] = np.arange(len(order), dtype=np.int32)
+
+        arrays = {
+            "vocab": np.frombuffer(
+                b"".join(encoded[word] for word in order), dtype=np.uint8
+            ),
+            "offsets": np.concatenate([
+                [0], np.cumsum([len(encoded[word]) for word in order])
+            ]).astype(np.int64),
+            "ids": np.asarray(self.cluster_ids, dtype=np.int32)[order],
+            "keys": np.asarray(self.cluster_keys, dtype=np.uint32),
+            "members": rank[np.asarray(self.members, dtype=np.int64)],
+            "member_offsets": np.asarray(self.member_offsets, np.int64)
+        }
+        for name, array in arrays.items():
+            np.save(f"{prefix}.{name}.npy", array)
+
+    def load_binary(
+            self,
+            prefix: str
+    ) -> None:
+        """
+        Memory-maps a mapping saved by `save_binary`. Nothing is
+        copied or parsed, and `word_to_cluster` and `cluster_to_words`
+        become read-only views over the arrays.
+        """
+        arrays = {
+            name: np.load(f"{prefix}.{name}.npy", mmap_mode="r")
+            for name in [
+                "vocab", "offsets", "ids", "keys", "members",
+                "member_offsets"
+            ]
+        }
+        self.words = StringTable(arrays["vocab"], arrays["offsets"])
+        self.cluster_ids = arrays["ids"]
+        self.cluster_keys = arrays["keys"]
+        self.members = arrays["members"]
+        self.member_offsets = arrays["member_offsets"]
+        self.word_to_cluster = WordToClusterView(self)
+        self.cluster_to_words = ClusterToWordsView(self)
+
+    def get_key_lookup(
+            self,
+            units: list[str]
+    ) -> np.ndarray:
+        """
+        Returns the codepoint of the cluster key of every unit, indexed
+        by unit id, with -1 for units that are not clustered.
+        """
+        word_index = {word: idx for idx, word in enumerate(self.words)}
+        cluster_ids = self.cluster_ids[
+            [word_index.get(unit, 0) for unit in units]
+        ]
+        cluster_ids[[unit not in word_index for unit in units]] = -1
+        return np.where(
+            cluster_ids != -1,
+            self.cluster_keys[np.maximum(cluster_ids, 0)].astype(np.int64),
+            -1
+        )
+
+    def map_unit_ids(
+            self,
+            lookup: np.ndarray,
+            unit_ids: np.ndarray,
+            units: list[str]
+    ) -> np.ndarray:
+        """
+        Maps unit ids to the codepoints of their cluster keys using a
+        lookup from `get_key_lookup`.
+        """
+        codepoints = np.take(lookup, unit_ids)
+        missing = np.flatnonzero(codepoints == -1)
+        if len(missing):
+            raise KeyError(units[unit_ids[missing[0]]])
+        return codepoints.astype(np.uint32)
+
+    def write_corpus(
+            self,
+            corpus_file: str,
+            corpus: Union[TokenIdCache, Iterable[np.ndarray]],
+            units: list[str] = None,
+            chunk_lines: int = 100000
+    ) -> int:
+        """
+        Writes an encoded corpus as a corpus of cluster keys, one line
+        per encoded line, and returns the number of lines. `corpus` is
+        a token id cache, or an iterable of unit id arrays, one per
+        line, indexing into `units`, which may grow while iterating.
+        """
+        if isinstance(corpus, TokenIdCache):
+            units = corpus.units.tolist()
+            chunks = (
+                (
+                    corpus.ids[corpus.offsets[start]:corpus.offsets[end]],
+                    corpus.offsets[start:end + 1] - corpus.offsets[start]
+                )
+                for start, end in (
+                    (start, min(start + chunk_lines, len(corpus)))
+                    for start in range(0, len(corpus), chunk_lines)
+                )
+            )
+        else:
+            chunks = (
+                (
+                    np.concatenate(lines),
+                    np.concatenate([[0], np.cumsum([len(x) for x in lines])])
+                )
+                for lines in _iter_chunks(corpus, chunk_lines)
+            )
+
+        n_lines = 0
+        lookup = np.zeros(0, dtype=np.int64)
+        with open(corpus_file, "w+", encoding="utf-8") as corpus_fp:
+            for ids, offsets in chunks:
+                # Extend the key lookup to units added since the last chunk
+                if len(lookup) < len(units):
+                    lookup = np.concatenate([
+                        lookup, self.get_key_lookup(units[len(lookup):])
+                    ])
+                codepoints = self.map_unit_ids(lookup, ids, units)
+                # Newline after the last unit of every line
+                corpus_fp.write(
+                    codepoints_to_text(
+                        np.insert(codepoints, offsets[1:], ord("\n"))
+                    )
+                )
+                n_lines += len(offsets) - 1
+        return n_lines
 
     def save_mapping(
             self,
             map_file: str = None,
-            map_dir: str = "data/level_wise/levelX"
+            map_dir: str = "data/level_wise/levelX",
+            binary: bool = True
     ) -> None:
+        """
+        Saves the mapping as text, with cluster key and comma-separated
+        words separated by a tab-space, and by default also in the
+        binary format of `save_binary` alongside it.
+        """
         if map_file is None:
             map_dir = map_dir.strip("/")
             makedirs(map_dir, exist_ok=True)
@@ -106,3 +705,6 @@ class Cluster:
                     )
                     + "\n"
                 )
+
+        if binary:
+            self.save_binary(_binary_prefix(map_file))
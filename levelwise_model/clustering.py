@@ -0,0 +1,254 @@
+"""
+This module contains the algorithms that cluster a level's Word2Vec
+vocabulary. Every algorithm takes the L2-normalised vectors and
+returns the word indices of every cluster.
+"""
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+from levelwise_model.neighbours import NeighbourIndex
+
+
+def greedy_clusters(
+        vectors: np.ndarray,
+        threshold: float,
+        neighbour_index: NeighbourIndex,
+        topn: int = 200,
+        block_size: int = 1024
+) -> list[list[int]]:
+    """
+    Greedily clusters the vocabulary. In vocabulary order, every word
+    that is not clustered yet starts a new cluster, which takes in its
+    `topn` most similar words scoring above `threshold`.
+
+    Neighbours are searched for blocks of `block_size` query words at
+    once.
+    """
+    n_words = len(vectors)
+    cluster_ids = np.full(n_words, -1, dtype=np.int32)
+    members = []
+
+    for block_start in range(0, n_words, block_size):
+        # Words clustered before this block cannot start a cluster
+        rows = np.arange(block_start, min(block_start + block_size, n_words))
+        rows = rows[cluster_ids[rows] == -1]
+        if not len(rows):
+            continue
+
+        # One extra result as a word is its own nearest neighbour
+        indices, scores = neighbour_index.search(vectors[rows], topn + 1)
+
+        for row, row_indices, row_scores in zip(rows, indices, scores):
+            # Check if word has been clustered earlier in the block
+            if cluster_ids[row] != -1:
+                continue
+
+            # Neighbours among the top n above the threshold, most
+            # similar first
+            found = (row_indices != row) & (row_indices != -1)
+            row_indices = row_indices[found][:topn]
+            neighbours = row_indices[row_scores[found][:topn] > threshold]
+
+            # Create new cluster with the word and all similar words
+            cluster_ids[row] = len(members)
+            cluster_ids[neighbours] = len(members)
+            members.append([row] + neighbours.tolist())
+
+    return members
+
+
+def kmeans_clusters(
+        vectors: np.ndarray,
+        threshold: float,
+        neighbour_index: NeighbourIndex,
+        n_clusters: int = None,
+        batch_size: int = 4096,
+        n_iter: int = 100,
+        seed: int = 0,
+        block_size: int = 65536
+) -> list[list[int]]:
+    """
+    Clusters the vocabulary into `n_clusters` clusters with mini-batch
+    spherical k-means. The threshold and neighbour index are not used.
+
+    Every iteration assigns a random batch of `batch_size` words to
+    their most similar centroid and moves each centroid towards the
+    mean of its batch words, with a per-centroid learning rate of one
+    over the number of words it has seen.
+    """
+    if n_clusters is None:
+        raise ValueError("K-means clustering needs `n_clusters`.")
+
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[
+        rng.choice(len(vectors), size=n_clusters, replace=False)
+    ].astype(np.float32)
+    counts = np.zeros(n_clusters, dtype=np.int64)
+
+    for _ in range(n_iter):
+        batch = vectors[rng.integers(len(vectors), size=batch_size)]
+        assignments = np.argmax(batch @ centroids.T, axis=1)
+
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, batch)
+        batch_counts = np.bincount(assignments, minlength=n_clusters)
+        seen = batch_counts > 0
+
+        counts[seen] += batch_counts[seen]
+        centroids[seen] += (
+            sums[seen] - batch_counts[seen, None] * centroids[seen]
+        ) / counts[seen, None]
+        centroids[seen] /= np.maximum(
+            np.linalg.norm(centroids[seen], axis=1, keepdims=True),
+            np.finfo(np.float32).tiny
+        )
+
+    labels = np.concatenate([
+        np.argmax(vectors[start:start + block_size] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), block_size)
+    ])
+    return labels_to_members(labels)
+
+
+def _knn_edges(
+        vectors: np.ndarray,
+        threshold: float,
+        neighbour_index: NeighbourIndex,
+        topn: int,
+        block_size: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the edges of the kNN graph of the vocabulary as source,
+    target and similarity arrays, keeping edges above `threshold`.
+    """
+    sources, targets, weights = [], [], []
+    for start in range(0, len(vectors), block_size):
+        rows = np.arange(start, min(start + block_size, len(vectors)))
+        indices, scores = neighbour_index.search(vectors[rows], topn + 1)
+        keep = (
+            (indices != rows[:, None])
+            & (indices != -1)
+            & (scores > threshold)
+        )
+        sources.append(np.broadcast_to(rows[:, None], indices.shape)[keep])
+        targets.append(indices[keep])
+        weights.append(scores[keep])
+
+    return (
+        np.concatenate(sources),
+        np.concatenate(targets),
+        np.concatenate(weights)
+    )
+
+
+def component_clusters(
+        vectors: np.ndarray,
+        threshold: float,
+        neighbour_index: NeighbourIndex,
+        topn: int = 10,
+        block_size: int = 1024
+) -> list[list[int]]:
+    """
+    Clusters the vocabulary into the connected components of its kNN
+    graph, linking every word to its `topn` most similar words scoring
+    above `threshold`.
+    """
+    sources, targets, _ = _knn_edges(
+        vectors, threshold, neighbour_index, topn, block_size
+    )
+    graph = csr_matrix(
+        (np.ones(len(sources), dtype=np.int8), (sources, targets)),
+        shape=(len(vectors), len(vectors))
+    )
+    _, labels = connected_components(graph, directed=False)
+    return labels_to_members(labels)
+
+
+def agglomerative_clusters(
+        vectors: np.ndarray,
+        threshold: float,
+        neighbour_index: NeighbourIndex,
+        topn: int = 10,
+        max_cluster_size: int = 50,
+        block_size: int = 1024
+) -> list[list[int]]:
+    """
+    Clusters the vocabulary by merging clusters along the edges of its
+    kNN graph, most similar first (single linkage). Only edges to the
+    `topn` most similar words scoring above `threshold` are merged,
+    and merges that would exceed `max_cluster_size` words are skipped,
+    so that clusters do not chain across the whole vocabulary.
+
+    The edge search is blocked like the other methods, but the merges
+    run serially in Python, since each depends on the cluster sizes
+    left by the previous ones. With V words and E <= V * `topn` edges,
+    sorting the edges takes O(E log E) and the union-find, with path
+    halving and union by size, O(E alpha(V)) interpreted steps, alpha
+    being the inverse Ackermann function.
+    """
+    sources, targets, weights = _knn_edges(
+        vectors, threshold, neighbour_index, topn, block_size
+    )
+    order = np.argsort(-weights, kind="stable")
+
+    # Plain lists index faster than arrays in the merge loop
+    parents = list(range(len(vectors)))
+    sizes = [1] * len(vectors)
+
+    def find(word: int) -> int:
+        while parents[word] != word:
+            parents[word] = parents[parents[word]]
+            word = parents[word]
+        return word
+
+    for source, target in zip(
+        sources[order].tolist(), targets[order].tolist()
+    ):
+        source, target = find(source), find(target)
+        if source == target or \
+                sizes[source] + sizes[target] > max_cluster_size:
+            continue
+        if sizes[source] < sizes[target]:
+            source, target = target, source
+        parents[target] = source
+        sizes[source] += sizes[target]
+
+    return labels_to_members(
+        np.array([find(word) for word in range(len(parents))])
+    )
+
+
+def labels_to_members(labels: np.ndarray) -> list[list[int]]:
+    """
+    Returns the word indices of every cluster from a cluster label per
+    word. Clusters are ordered by their first word, and words by index.
+    """
+    order = np.argsort(labels, kind="stable")
+    _, first, counts = np.unique(
+        labels, return_index=True, return_counts=True
+    )
+    members = np.split(order, np.cumsum(counts)[:-1])
+    return [members[cluster].tolist() for cluster in np.argsort(first)]
+
+
+clustering_methods = {
+    "greedy": greedy_clusters,
+    "kmeans": kmeans_clusters,
+    "components": component_clusters,
+    "agglomerative": agglomerative_clusters
+}
+
+
+def get_clustering_method(name: str):
+    """
+    Returns a clustering algorithm by name ("greedy", "kmeans",
+    "components" or "agglomerative").
+    """
+    if name not in clustering_methods:
+        raise ValueError(
+            f"Unknown clustering method `{name}`. "
+            f"Use one of {list(clustering_methods)}."
+        )
+    return clustering_methods[name]
@@ -4,20 +4,78 @@ for SentencePiece and Word2Vec
 """
 
 
-class SentencePieceConfig:
+class _ConfigDict:
+    # Fields that only affect speed, not the trained model
+    runtime_fields = ()
+
+    def to_dict(
+            self,
+            include_runtime: bool = True
+    ) -> dict:
+        """
+        Returns the fields as a dict, with nested configs as dicts.
+        Runtime fields are left out unless `include_runtime`.
+        """
+        return {
+            key: (
+                value.to_dict(include_runtime)
+                if isinstance(value, _ConfigDict) else value
+            )
+            for key, value in vars(self).items()
+            if include_runtime or key not in self.runtime_fields
+        }
+
+
+class SentencePieceConfig(_ConfigDict):
+    # Fields that only affect speed, not the trained model
+    runtime_fields = (
+        "encode_workers", "encode_batch_size", "stream_input",
+        "utterance_cache_size", "utterance_workers", "utterance_chunk_size"
+    )
+
     def __init__(
         self,
         max_sentence_length: int = 5000,
         vocab_size: int = 20000,
         model_type: str = "unigram",
         model_tag: str = "lw",
-        use_model: str = None
+        use_model: str = None,
+        encode_workers: int = -1,
+        encode_batch_size: int = 10000,
+        input_sentence_size: int = 0,
+        shuffle_input_sentence: bool = True,
+        sample_rate: float = 1.0,
+        stream_input: bool = False,
+        seed: int = None,
+        train_extremely_large_corpus: bool = True,
+        utterance_cache_size: int = 100000,
+        utterance_workers: int = 1,
+        utterance_chunk_size: int = 10000
     ):
         self.max_sentence_length = max_sentence_length
         self.vocab_size = vocab_size
         self.model_type = model_type
         self.model_tag = model_tag
         self.use_model = use_model
+        # Threads (-1 for all cores) and batch size for encoding
+        self.encode_workers = encode_workers
+        self.encode_batch_size = encode_batch_size
+        # Training input. At most `input_sentence_size` sentences (0 for
+        # all) are kept, reservoir-sampled if `shuffle_input_sentence`,
+        # out of the sentences kept with probability `sample_rate`.
+        self.input_sentence_size = input_sentence_size
+        self.shuffle_input_sentence = shuffle_input_sentence
+        self.sample_rate = sample_rate
+        # Feed the trainer from a sentence iterator instead of the file
+        self.stream_input = stream_input
+        self.seed = seed
+        self.train_extremely_large_corpus = train_extremely_large_corpus
+        # Number of utterances whose encodings are cached per level
+        self.utterance_cache_size = utterance_cache_size
+        # Processes (1 for in-process) and utterances per chunk for the
+        # utterance update
+        self.utterance_workers = utterance_workers
+        self.utterance_chunk_size = utterance_chunk_size
 
     def get_model_name(
             self,
@@ -30,18 +88,33 @@ class SentencePieceConfig:
             f"{self.model_type}_vs{self.vocab_size}_{self.model_tag}"
 
 
-class Word2VecConfig:
+class Word2VecConfig(_ConfigDict):
+    # Fields that only affect speed, not the trained model
+    runtime_fields = ("workers", "use_corpus_file")
+
     def __init__(
         self,
         vector_size: int = 100,
         window: int = 5,
         model_tag: str = "lw",
-        use_model: str = None
+        use_model: str = None,
+        workers: int = 4,
+        epochs: int = 7,
+        negative: int = 5,
+        sample: float = 1e-3,
+        use_corpus_file: bool = False
     ):
         self.vector_size = vector_size
         self.window = window
         self.model_tag = model_tag
         self.use_model = use_model
+        self.workers = workers
+        self.epochs = epochs
+        self.negative = negative
+        self.sample = sample
+        # Train from a LineSentence file, which scales with `workers`
+        # as it does not go through the GIL
+        self.use_corpus_file = use_corpus_file
 
     def get_model_path(
             self,
@@ -54,13 +127,25 @@ class Word2VecConfig:
             f"w2v_vs{self.vector_size}_w{self.window}_{self.model_tag}.model"
 
 
-class Config:
+class Config(_ConfigDict):
     def __init__(
             self,
             sp_config: SentencePieceConfig = SentencePieceConfig(),
             w2v_config: Word2VecConfig = Word2VecConfig(),
-            cluster_threshold: float = 0.45
+            cluster_threshold: float = 0.45,
+            neighbour_index: str = "exact",
+            neighbour_index_args: dict = None,
+            cluster_method: str = "greedy",
+            cluster_method_args: dict = None
     ):
         self.sp_config = sp_config
         self.w2v_config = w2v_config
         self.cluster_threshold = cluster_threshold
+        # Neighbour search backend used for clustering ("exact" or
+        # "ivf") and its keyword arguments
+        self.neighbour_index = neighbour_index
+        self.neighbour_index_args = neighbour_index_args or {}
+        # Clustering method ("greedy", "kmeans", "components" or
+        # "agglomerative") and its keyword arguments
+        self.cluster_method = cluster_method
+        self.cluster_method_args = cluster_method_args or {}
@@ -0,0 +1,209 @@
+"""
+This module contains readers that stream a level's corpus
+instead of holding it in memory.
+"""
+import logging
+from hashlib import sha256
+from itertools import islice
+from json import dump, load
+from os import makedirs, path, replace
+from random import Random
+from typing import Iterator, Union
+
+import numpy as np
+import sentencepiece as spm
+
+from levelwise_model.encoder import PieceEncoder
+
+
+class EncodedCorpus:
+    """
+    Re-iterable view of a corpus file encoded with a SentencePiece
+    model. Every iteration reads the file again, so Word2Vec can go
+    over it for several epochs while memory stays flat.
+    """
+    def __init__(
+            self,
+            corpus_file: str,
+            sp_model: Union[spm.SentencePieceProcessor, PieceEncoder]
+    ):
+        self.corpus_file = corpus_file
+        self.encoder = PieceEncoder.wrap(sp_model)
+
+    def __iter__(self):
+        with open(self.corpus_file, "r", encoding="utf-8") as corpus_fp:
+            yield from self.encoder.iter_encode(corpus_fp)
+
+    def iter_ids(self) -> Iterator[np.ndarray]:
+        """
+        Reads the file again, yielding the unit ids of each line.
+        """
+        with open(self.corpus_file, "r", encoding="utf-8") as corpus_fp:
+            yield from self.encoder.iter_encode_ids(corpus_fp)
+
+
+def sample_sentences(
+        corpus_file: str,
+        sample_rate: float = 1.0,
+        seed: int = None
+) -> Iterator[str]:
+    """
+    Streams the sentences of a corpus file, keeping each one with
+    probability `sample_rate`.
+    """
+    rng = Random(seed)
+    with open(corpus_file, "r", encoding="utf-8") as corpus_fp:
+        for sentence in corpus_fp:
+            if sample_rate >= 1.0 or rng.random() < sample_rate:
+                yield sentence.rstrip("\n")
+
+
+def hash_file(
+        file_path: str,
+        chunk_size: int = 1 << 20
+) -> str:
+    """
+    Returns the SHA-256 hex digest of a file, read in chunks.
+    """
+    digest = sha256()
+    with open(file_path, "rb") as input_fp:
+        for chunk in iter(lambda: input_fp.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def count_lines(
+        file_path: str,
+        chunk_size: int = 1 << 20
+) -> int:
+    """
+    Returns the number of lines of a file, read in chunks. A last
+    line without a newline is counted.
+    """
+    n_lines = 0
+    last_chunk = b""
+    with open(file_path, "rb") as input_fp:
+        for chunk in iter(lambda: input_fp.read(chunk_size), b""):
+            n_lines += chunk.count(b"\n")
+            last_chunk = chunk
+    if last_chunk and not last_chunk.endswith(b"\n"):
+        n_lines += 1
+    return n_lines
+
+
+class TokenIdCache:
+    """
+    Encoded corpus persisted as a flat int32 array of unit ids and an
+    int64 array of line offsets, both memory-mapped on reuse. The
+    cache is keyed by the hashes of the corpus file and of the
+    SentencePiece model, so it is rebuilt only when either changes.
+
+    Iterating yields the units of each line like `EncodedCorpus`,
+    with the unit strings shared from a single table instead of
+    allocated per token.
+    """
+    def __init__(
+            self,
+            corpus_file: str,
+            encoder: PieceEncoder,
+            cache_dir: str = "data/level_wise/levelX/cache"
+    ):
+        """
+        Inputs
+        ------
+            corpus_file : str
+                Filepath of the corpus, one sentence per line.
+            encoder : PieceEncoder
+                Encoder of the level the cache belongs to.
+            cache_dir : str, OPTIONAL
+                Directory holding the cache files.
+        """
+        self.logger = logging.getLogger("TokenIdCache")
+        self.corpus_file = corpus_file
+        self.encoder = encoder
+
+        cache_dir = cache_dir.rstrip("/")
+        makedirs(cache_dir, exist_ok=True)
+        model_hash = sha256(
+            encoder.sp_model.serialized_model_proto()
+        ).hexdigest()
+        key = f"{hash_file(corpus_file)[:16]}_{model_hash[:16]}"
+        self.ids_file = f"{cache_dir}/{key}.ids"
+        self.offsets_file = f"{cache_dir}/{key}.offsets"
+        self.units_file = f"{cache_dir}/{key}.units.json"
+
+        if not path.isfile(self.units_file):
+            self.logger.debug(f"Building token id cache {key} ...")
+            self._build()
+            self.logger.info(f"Built token id cache {key}.")
+        else:
+            self.logger.info(f"Using token id cache {key}.")
+
+        self.ids = self._memmap(self.ids_file, np.int32)
+        self.offsets = self._memmap(self.offsets_file, np.int64)
+
+        # Cached ids may reference surfaces of unknown pieces that the
+        # current encoder has not seen
+        with open(self.units_file, "r", encoding="utf-8") as units_fp:
+            overflow = load(units_fp)
+        self.units = np.array(
+            self.encoder.units[:encoder.sp_model.get_piece_size()]
+            + overflow,
+            dtype=object
+        )
+
+    @staticmethod
+    def _memmap(
+            file_path: str,
+            dtype: type
+    ) -> np.ndarray:
+        if path.getsize(file_path) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(file_path, dtype=dtype, mode="r")
+
+    def _build(self) -> None:
+        """
+        Encodes the corpus batch by batch and writes the arrays to
+        temporary files, which are moved in place once complete.
+        """
+        n_units = 0
+        with open(self.corpus_file, "r", encoding="utf-8") as corpus_fp, \
+                open(self.ids_file + ".tmp", "wb") as ids_fp, \
+                open(self.offsets_file + ".tmp", "wb") as offsets_fp:
+            np.zeros(1, dtype=np.int64).tofile(offsets_fp)
+            batch = list(islice(corpus_fp, self.encoder.batch_size))
+            while batch:
+                lines = self.encoder.encode_ids(batch)
+                lengths = np.array([len(line) for line in lines])
+                np.concatenate(lines).astype(np.int32).tofile(ids_fp)
+                (n_units + np.cumsum(lengths, dtype=np.int64)).tofile(
+                    offsets_fp
+                )
+                n_units += int(lengths.sum())
+                batch = list(islice(corpus_fp, self.encoder.batch_size))
+
+        with open(
+            self.units_file + ".tmp", "w", encoding="utf-8"
+        ) as units_fp:
+            dump(list(self.encoder.overflow), units_fp)
+
+        # The units file marks a complete cache, so it is moved last
+        replace(self.ids_file + ".tmp", self.ids_file)
+        replace(self.offsets_file + ".tmp", self.offsets_file)
+        replace(self.units_file + ".tmp", self.units_file)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def line_ids(
+            self,
+            line: int
+    ) -> np.ndarray:
+        """
+        Returns the unit ids of a single line.
+        """
+        return self.ids[self.offsets[line]:self.offsets[line + 1]]
+
+    def __iter__(self):
+        for line in range(len(self)):
+            yield self.units[self.line_ids(line)].tolist()
@@ -0,0 +1,236 @@
+"""
+This module contains the utterance embedding matrix shared by the
+tests of a test bench.
+"""
+from multiprocessing.shared_memory import SharedMemory
+from os import path
+from typing import Union
+
+import numpy as np
+
+from levelwise_model.utterances import UtteranceList, WordToUtteranceMapping
+
+
+class UtteranceEmbeddings:
+    """
+    Vectors of the unique utterances of a mapping, embedded once into
+    the rows of a float32 `matrix`. `rows` holds the matrix row of
+    every utterance index of the mapping, or of every utterance of a
+    list of utterances. Utterances that could not be
+    embedded have NaN rows, and they and non-finite vectors are marked
+    in `valid`.
+
+    After `share`, the matrix and its normalised copy live in shared
+    memory, and pickled copies of the embeddings attach to it instead
+    of copying them.
+    """
+    def __init__(
+            self,
+            utterances: Union[WordToUtteranceMapping, list[str]],
+            word_vec_fn: callable,
+            embeddings_file: str = None,
+            batch_size: int = 10000
+    ):
+        """
+        Inputs
+        ------
+            utterances : WordToUtteranceMapping or list of str
+                Mapping whose utterances are embedded, or a list of
+                utterances.
+            word_vec_fn : callable
+                A function that returns embeddings for a string
+                input. If it has an `embed` method, it is used to
+                embed batches of `batch_size` utterances at once.
+            embeddings_file : str, OPTIONAL
+                File to load the matrix from if it holds all
+                utterances, otherwise to save it to after embedding.
+            batch_size : int, OPTIONAL
+                Number of utterances embedded at once.
+                (default = 10000)
+        """
+        iter_utterances = utterances.iter_utterances \
+            if isinstance(utterances, WordToUtteranceMapping) \
+            else utterances.__iter__
+        keys = list(dict.fromkeys(iter_utterances()))
+        if embeddings_file is None or not self.load(embeddings_file, keys):
+            self.keys = keys
+            self._embed(word_vec_fn, batch_size)
+            if embeddings_file is not None:
+                self.save(embeddings_file)
+
+        self._normed = None
+        self._shm = None
+        self._owner = False
+        row_index = {key: row for row, key in enumerate(self.keys)}
+        self.rows = np.fromiter(
+            (row_index[utterance] for utterance in iter_utterances()),
+            dtype=np.int64,
+            count=len(utterances)
+        )
+
+    def _embed(
+            self,
+            word_vec_fn: callable,
+            batch_size: int
+    ) -> None:
+        embed = getattr(word_vec_fn, "embed", None)
+        vectors = []
+        for start in range(0, len(self.keys), batch_size):
+            batch = self.keys[start:start + batch_size]
+            if embed is not None:
+                try:
+                    vectors.extend(np.asarray(embed(batch), np.float32))
+                    continue
+                except Exception:
+                    # Fall back to single utterances to find the failing
+                    # ones, as the tests count errors per utterance
+                    pass
+            for key in batch:
+                try:
+                    vectors.append(
+                        np.asarray(word_vec_fn(key), np.float32).reshape(-1)
+                    )
+                except Exception:
+                    vectors.append(None)
+
+        self.valid = np.array(
+            [
+                vector is not None and bool(np.all(np.isfinite(vector)))
+                for vector in vectors
+            ],
+            dtype=bool
+        )
+        size = next(
+            (len(vector) for vector in vectors if vector is not None), 0
+        )
+        self.matrix = np.full((len(vectors), size), np.nan, dtype=np.float32)
+        for row, vector in enumerate(vectors):
+            if vector is not None:
+                self.matrix[row] = vector
+
+    @property
+    def normed(self) -> np.ndarray:
+        """
+        The matrix with L2-normalised rows. Zero rows stay zero.
+        """
+        if self._normed is None:
+            norms = np.linalg.norm(self.matrix, axis=1, keepdims=True)
+            self._normed = self.matrix / np.maximum(
+                norms, np.finfo(np.float32).tiny
+            )
+        return self._normed
+
+    def share(self) -> None:
+        """
+        Moves the matrix and its normalised copy into one shared memory
+        block, which is freed by `close`.
+        """
+        if self._shm is not None:
+            return
+        normed = self.normed
+        self._shm = SharedMemory(create=True, size=max(1, 2 * normed.nbytes))
+        block = np.ndarray(
+            (2, *normed.shape), dtype=np.float32, buffer=self._shm.buf
+        )
+        block[0] = self.matrix
+        block[1] = normed
+        self.matrix, self._normed = block
+        self._owner = True
+
+    def close(self) -> None:
+        """
+        Copies the matrices out of shared memory and detaches from it.
+        The block is freed if these embeddings created it.
+        """
+        if self._shm is None:
+            return
+        self.matrix = self.matrix.copy()
+        self._normed = self._normed.copy()
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+        self._shm = None
+        self._owner = False
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        if self._shm is not None:
+            # Attach to the shared block instead of pickling the matrices
+            state["matrix"] = state["_normed"] = None
+            state["_shm"] = (self._shm.name, self.matrix.shape)
+            state["_owner"] = False
+        return state
+
+    def __setstate__(
+            self,
+            state: dict
+    ) -> None:
+        self.__dict__.update(state)
+        if self._shm is None:
+            return
+        name, shape = self._shm
+        # Only the creator unlinks the block. Child processes share its
+        # resource tracker, so attaching does not take it over.
+        self._shm = SharedMemory(name=name)
+        self._owner = False
+        self.matrix, self._normed = np.ndarray(
+            (2, *shape), dtype=np.float32, buffer=self._shm.buf
+        )
+
+    def load(
+            self,
+            embeddings_file: str,
+            keys: list[str]
+    ) -> bool:
+        """
+        Loads a saved matrix. Returns False, loading nothing, if the
+        file does not exist or misses some of `keys`.
+        """
+        if not path.isfile(embeddings_file):
+            return False
+        with np.load(embeddings_file) as data:
+            matrix = data["matrix"]
+            saved = str(data["keys"]).split("\n") if len(matrix) else []
+            if not set(keys) <= set(saved):
+                return False
+            self.keys = saved
+            self.matrix = matrix
+            self.valid = data["valid"]
+        return True
+
+    def save(
+            self,
+            embeddings_file: str
+    ) -> None:
+        """
+        Saves the matrix, validity flags and utterances as an `.npz`
+        file. Utterances are stored newline-separated.
+        """
+        with open(embeddings_file, "wb") as embeddings_fp:
+            np.savez(
+                embeddings_fp,
+                matrix=self.matrix,
+                valid=self.valid,
+                keys=np.array("\n".join(self.keys))
+            )
+
+    def rows_of(
+            self,
+            utterances: UtteranceList
+    ) -> np.ndarray:
+        """
+        Returns the matrix rows of a list of utterances of the mapping.
+        """
+        return self.rows[utterances.indices]
+
+    def check(
+            self,
+            rows: np.ndarray
+    ) -> None:
+        """
+        Raises a KeyError if any of `rows` could not be embedded.
+        """
+        invalid = np.flatnonzero(~self.valid[rows])
+        if len(invalid):
+            raise KeyError(self.keys[rows[invalid[0]]])
+
@@ -0,0 +1,161 @@
+"""
+This module contains the batch SentencePiece encoder shared by
+corpus and utterance conversion.
+"""
+from typing import Iterable, Iterator, Union
+
+import numpy as np
+import sentencepiece as spm
+
+
+class PieceEncoder:
+    """
+    Encodes text into the units used by the level-wise model.
+    Text is sent to SentencePiece in large batches so that its
+    multi-threaded encoder does the work, and the "▁" pieces are
+    filtered and stripped on the batch result.
+    """
+    def __init__(
+            self,
+            sp_model: spm.SentencePieceProcessor,
+            n_workers: int = -1,
+            batch_size: int = 10000
+    ):
+        """
+        Inputs
+        ------
+            sp_model : SentencePieceProcessor
+                Loaded SentencePiece model.
+            n_workers : int, OPTIONAL
+                Number of encoding threads. -1 uses all available
+                cores. (default = -1)
+            batch_size : int, OPTIONAL
+                Number of texts sent to SentencePiece at once.
+                (default = 10000)
+        """
+        self.sp_model = sp_model
+        self.n_workers = n_workers
+        self.batch_size = batch_size
+
+        # Units indexed by id. SentencePiece pieces come first, followed
+        # by surfaces of unknown pieces, which get ids past the vocab so
+        # that id and string encodings stay equivalent.
+        self.units = [
+            self.sp_model.id_to_piece(idx).replace("▁", "")
+            for idx in range(self.sp_model.get_piece_size())
+        ]
+        self.overflow = {}
+        self._unk_id = self.sp_model.unk_id()
+        self._space_id = self.sp_model.piece_to_id("▁")
+        if self.sp_model.id_to_piece(self._space_id) != "▁":
+            self._space_id = -1
+
+    @classmethod
+    def wrap(
+            cls,
+            sp_model: Union[spm.SentencePieceProcessor, "PieceEncoder"]
+    ) -> "PieceEncoder":
+        """
+        Returns the input if it already is an encoder, otherwise wraps
+        the SentencePiece model with the default settings.
+        """
+        if isinstance(sp_model, cls):
+            return sp_model
+        return cls(sp_model)
+
+    def encode(
+            self,
+            texts: list[str]
+    ) -> list[list[str]]:
+        """
+        Encodes a batch of texts into lists of units.
+        """
+        pieces = self.sp_model.encode(
+            texts,
+            out_type=str,
+            num_threads=self.n_workers
+        )
+
+        return [
+            [piece.replace("▁", "") for piece in line if piece != "▁"]
+            for line in pieces
+        ]
+
+    def encode_ids(
+            self,
+            texts: list[str]
+    ) -> list[np.ndarray]:
+        """
+        Encodes a batch of texts into arrays of unit ids. Ids index
+        into `units`.
+        """
+        ids = self.sp_model.encode(
+            texts,
+            out_type=int,
+            num_threads=self.n_workers
+        )
+
+        encoded = []
+        for text, line in zip(texts, ids):
+            line = np.asarray(line, dtype=np.int32)
+            unknown = np.flatnonzero(line == self._unk_id)
+            if len(unknown):
+                # Recover the surfaces of unknown pieces
+                pieces = self.sp_model.encode(text, out_type=str)
+                for position in unknown:
+                    if pieces[position] == "▁":
+                        line[position] = self._space_id
+                    else:
+                        line[position] = self._overflow_id(
+                            pieces[position].replace("▁", "")
+                        )
+            encoded.append(line[line != self._space_id])
+
+        return encoded
+
+    def _overflow_id(
+            self,
+            surface: str
+    ) -> int:
+        if surface not in self.overflow:
+            self.overflow[surface] = len(self.units)
+            self.units.append(surface)
+        return self.overflow[surface]
+
+    def iter_batches(
+            self,
+            texts: Iterable[str]
+    ) -> Iterator[list[str]]:
+        """
+        Groups a stream of texts into batches of `batch_size`.
+        """
+        batch = []
+        for text in texts:
+            batch.append(text)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def iter_encode(
+            self,
+            texts: Iterable[str]
+    ) -> Iterator[list[str]]:
+        """
+        Encodes a stream of texts batch by batch, yielding one list of
+        units per input text, in order.
+        """
+        for batch in self.iter_batches(texts):
+            yield from self.encode(batch)
+
+    def iter_encode_ids(
+            self,
+            texts: Iterable[str]
+    ) -> Iterator[np.ndarray]:
+        """
+        Encodes a stream of texts batch by batch, yielding one array of
+        unit ids per input text, in order.
+        """
+        for batch in self.iter_batches(texts):
+            yield from self.encode_ids(batch)
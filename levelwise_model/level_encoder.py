@@ -0,0 +1,264 @@
+"""
+This module contains the per-level utterance encoder, which caches
+the encodings of repeated utterances.
+"""
+from collections import OrderedDict
+from typing import Iterable, Iterator, Union
+
+import numpy as np
+import sentencepiece as spm
+from gensim.models import KeyedVectors
+
+from levelwise_model.cluster import Cluster, codepoints_to_text
+from levelwise_model.encoder import PieceEncoder
+
+
+class LevelEncoder:
+    """
+    Encodes utterances at a level into unit ids, cluster key strings
+    and vectors. Results are cached per utterance string in a bounded
+    LRU cache, so utterances repeated in the mapping, in the tests and
+    in the utterance update are only encoded once.
+    """
+    def __init__(
+            self,
+            encoder: PieceEncoder,
+            keyed_vectors: KeyedVectors = None,
+            clusters: Cluster = None,
+            max_size: int = 100000
+    ):
+        """
+        Inputs
+        ------
+            encoder : PieceEncoder
+                Encoder of the level's SentencePiece model.
+            keyed_vectors : KeyedVectors, OPTIONAL
+                Vectors of the level's Word2Vec model, for `vector`.
+            clusters : Cluster, OPTIONAL
+                Clusters of the level, for `encode_codes`.
+            max_size : int, OPTIONAL
+                Maximum number of cached utterances. (default = 100000)
+        """
+        self.encoder = encoder
+        self.wv = keyed_vectors
+        self.max_size = max_size
+
+        self._entries = OrderedDict()
+        self.stats = {
+            kind: {"hits": 0, "misses": 0}
+            for kind in ["ids", "codes", "vector"]
+        }
+
+        # Word2Vec row of every unit id, -1 if it has no vector
+        self._unit_rows = np.zeros(0, dtype=np.int64)
+
+        self.clusters = None
+        self._key_lookup = None
+        self.set_clusters(clusters)
+
+    @classmethod
+    def wrap(
+            cls,
+            encoder: Union[
+                spm.SentencePieceProcessor, PieceEncoder, "LevelEncoder"
+            ]
+    ) -> "LevelEncoder":
+        """
+        Returns the input if it already is a level encoder, otherwise
+        wraps it with an empty cache.
+        """
+        if isinstance(encoder, cls):
+            return encoder
+        return cls(PieceEncoder.wrap(encoder))
+
+    def set_clusters(
+            self,
+            clusters: Cluster
+    ) -> None:
+        """
+        Sets the clusters used by `encode_codes`, dropping cached codes
+        of other clusters.
+        """
+        if clusters is self.clusters:
+            return
+        self.clusters = clusters
+        self._key_lookup = np.zeros(0, dtype=np.int64)
+        for entry in self._entries.values():
+            entry.pop("codes", None)
+
+    def _entry(
+            self,
+            text: str
+    ) -> dict:
+        entry = self._entries.get(text)
+        if entry is None:
+            entry = {}
+            self._entries[text] = entry
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(text)
+        return entry
+
+    def _fill(
+            self,
+            kind: str,
+            texts: list[str],
+            compute
+    ) -> list:
+        """
+        Returns the cached `kind` of every text, computing the missing
+        ones in a single call of `compute` on the unique missing texts.
+        """
+        entries = [self._entry(text) for text in texts]
+        missing = {}
+        for text, entry in zip(texts, entries):
+            if kind in entry or text in missing:
+                self.stats[kind]["hits"] += 1
+            else:
+                missing[text] = None
+                self.stats[kind]["misses"] += 1
+
+        if missing:
+            missing = dict(zip(missing, compute(list(missing))))
+            for text, entry in zip(texts, entries):
+                if kind not in entry:
+                    entry[kind] = missing[text]
+
+        return [entry[kind] for entry in entries]
+
+    def encode_ids(
+            self,
+            texts: list[str]
+    ) -> list[np.ndarray]:
+        """
+        Encodes a batch of texts into arrays of unit ids, which index
+        into `encoder.units`.
+        """
+        return self._fill("ids", texts, self.encoder.encode_ids)
+
+    def iter_encode_ids(
+            self,
+            texts: Iterable[str]
+    ) -> Iterator[np.ndarray]:
+        """
+        Encodes a stream of texts batch by batch, yielding one array of
+        unit ids per input text, in order.
+        """
+        for batch in self.encoder.iter_batches(texts):
+            yield from self.encode_ids(batch)
+
+    def _codes(
+            self,
+            texts: list[str]
+    ) -> list[str]:
+        lines = self.encode_ids(texts)
+
+        # Extend the key lookup to units added since the last call
+        units = self.encoder.units
+        if len(self._key_lookup) < len(units):
+            self._key_lookup = np.concatenate([
+                self._key_lookup,
+                self.clusters.get_key_lookup(units[len(self._key_lookup):])
+            ])
+
+        offsets = np.concatenate([[0], np.cumsum([len(x) for x in lines])])
+        text = codepoints_to_text(
+            self.clusters.map_unit_ids(
+                self._key_lookup,
+                np.concatenate(lines),
+                units
+            )
+        )
+        return [
+            text[start:end] for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+
+    def encode_codes(
+            self,
+            texts: list[str]
+    ) -> list[str]:
+        """
+        Rewrites a batch of texts as strings of cluster keys.
+        """
+        return self._fill("codes", texts, self._codes)
+
+    def iter_encode_codes(
+            self,
+            texts: Iterable[str]
+    ) -> Iterator[str]:
+        """
+        Rewrites a stream of texts batch by batch, yielding one string
+        of cluster keys per input text, in order.
+        """
+        for batch in self.encoder.iter_batches(texts):
+            yield from self.encode_codes(batch)
+
+    def _vectors(
+            self,
+            texts: list[str]
+    ) -> list[np.ndarray]:
+        # Units of all texts out of the vocabulary, encoded at once
+        oov = [text for text in texts if text not in self.wv.key_to_index]
+        oov_ids = dict(zip(oov, self.encode_ids(oov)))
+
+        # Extend the row lookup to units added since the last call
+        units = self.encoder.units
+        if len(self._unit_rows) < len(units):
+            self._unit_rows = np.concatenate([
+                self._unit_rows,
+                [
+                    self.wv.key_to_index.get(unit, -1)
+                    for unit in units[len(self._unit_rows):]
+                ]
+            ]).astype(np.int64)
+
+        vectors = []
+        for text in texts:
+            if text in self.wv.key_to_index:
+                vector = self.wv[text].reshape(1, -1)
+            else:
+                ids = oov_ids[text]
+                rows = self._unit_rows[ids]
+                if np.any(rows == -1):
+                    raise KeyError(units[ids[np.argmax(rows == -1)]])
+                vector = self.wv.vectors[rows].mean(axis=0).reshape(1, -1)
+
+            vector.setflags(write=False)
+            vectors.append(vector)
+        return vectors
+
+    def vector(
+            self,
+            text: str
+    ) -> np.ndarray:
+        """
+        Returns the vector of a text as a (1, vector size) array: its
+        own vector if it is in the Word2Vec vocabulary, otherwise the
+        mean of the vectors of its units.
+        """
+        return self._fill("vector", [text], self._vectors)[0]
+
+    def vectors(
+            self,
+            texts: list[str]
+    ) -> np.ndarray:
+        """
+        Returns the vectors of a batch of texts as the rows of a
+        (number of texts, vector size) array.
+        """
+        return np.concatenate(self._fill("vector", texts, self._vectors))
+
+    def get_stats(self) -> dict:
+        """
+        Returns the hits, misses and hit rate of every cached result,
+        and the number of cached utterances.
+        """
+        stats = {"size": len(self._entries), "max_size": self.max_size}
+        for kind, counts in self.stats.items():
+            total = counts["hits"] + counts["misses"]
+            stats[kind] = {
+                **counts,
+                "hit_rate": counts["hits"] / total if total else None
+            }
+        return stats
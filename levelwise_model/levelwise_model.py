@@ -1,5 +1,10 @@
 import logging
-from os import makedirs
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
+from json import dump, load
+from os import makedirs, path, remove
+from pickle import dumps, loads
+from typing import Iterable, Union
 
 import numpy as np
 import sentencepiece as spm
@@ -7,8 +12,15 @@ from gensim.models.word2vec import Word2Vec
 
 from levelwise_model.cluster import Cluster
 from levelwise_model.config import Config, SentencePieceConfig, Word2VecConfig
+from levelwise_model.corpus import (
+    EncodedCorpus, TokenIdCache, count_lines, hash_file, sample_sentences
+)
+from levelwise_model.encoder import PieceEncoder
+from levelwise_model.level_encoder import LevelEncoder
+from levelwise_model.metrics import StageMetrics
 from levelwise_model.test_bench import TestBench
 from levelwise_model.utterances import WordToUtteranceMapping
+from levelwise_model.vectors import LevelVectorizer
 
 
 class LevelwiseModel:
@@ -61,6 +73,9 @@ class LevelwiseModel:
         self.clusters = []
         self.mappings = []
 
+        # Evaluations running in the background
+        self.pending_evals = []
+
     def _create_level_folders(
             self,
             level: int
@@ -81,11 +96,12 @@ class LevelwiseModel:
     def get_sentencepiece_from_config(
             self,
             sp_config: SentencePieceConfig,
-            input_file: str
+            input_file: Union[str, Iterable[str]]
     ) -> spm.SentencePieceProcessor:
         """
         Trains a SentencePiece model from a given
-        configuration and input file.
+        configuration and input file. The input can also be an
+        iterator of sentences.
         """
         sp_model = spm.SentencePieceProcessor()
 
@@ -96,14 +112,30 @@ class LevelwiseModel:
             )
             # Train SentencePiece
             self.logger.debug("Training SentencePiece model ...")
-            spm.SentencePieceTrainer.train(
-                f"--input={input_file} "
-                f"--model_type={sp_config.model_type} "
-                f"--model_prefix={model_name} "
-                f"--vocab_size={sp_config.vocab_size} "
-                f"--max_sentence_length={sp_config.max_sentence_length} "
-                f"--train_extremely_large_corpus"
-            )
+            trainer_args = {
+                "model_type": sp_config.model_type,
+                "model_prefix": model_name,
+                "vocab_size": sp_config.vocab_size,
+                "max_sentence_length": sp_config.max_sentence_length,
+                "input_sentence_size": sp_config.input_sentence_size,
+                "shuffle_input_sentence": sp_config.shuffle_input_sentence,
+                "train_extremely_large_corpus":
+                    sp_config.train_extremely_large_corpus
+            }
+            if not isinstance(input_file, str):
+                trainer_args["sentence_iterator"] = iter(input_file)
+            elif sp_config.stream_input or sp_config.sample_rate < 1.0:
+                trainer_args["sentence_iterator"] = sample_sentences(
+                    input_file,
+                    sample_rate=sp_config.sample_rate,
+                    seed=sp_config.seed
+                )
+            else:
+                trainer_args["input"] = input_file
+            if sp_config.seed is not None:
+                # Seeds the trainer's reservoir sampling
+                spm.set_random_generator_seed(sp_config.seed)
+            spm.SentencePieceTrainer.train(**trainer_args)
             self.logger.info("Created SentencePiece model.")
             self.logger.debug(f"Model path - {model_name}.")
 
@@ -122,7 +154,7 @@ class LevelwiseModel:
     def get_word2vec_from_config(
             self,
             w2v_config: Word2VecConfig,
-            sentences: list
+            sentences: Iterable
     ) -> Word2Vec:
         """
         Trains Word2Vec model with given configuration.
@@ -135,14 +167,36 @@ class LevelwiseModel:
             w2v_model_path = w2v_config.get_model_path(
                 model_dir=self.__curr_model_dir
             )
-            w2v_model = Word2Vec(
-                sentences,
-                window=w2v_config.window,
-                vector_size=w2v_config.vector_size,
-                min_count=0,
-                workers=4,
-                epochs=7
-            )
+            corpus_file = None
+            try:
+                if w2v_config.use_corpus_file:
+                    # Write the sentences once as a LineSentence file
+                    corpus_file = f"{self.__curr_data_dir}/w2v_corpus.txt"
+                    with open(
+                        corpus_file, "w+", encoding="utf-8"
+                    ) as corpus_fp:
+                        for sentence in sentences:
+                            corpus_fp.write(" ".join(sentence) + "\n")
+                    sentences = None
+                    self.logger.debug(
+                        f"Wrote Word2Vec corpus - {corpus_file}."
+                    )
+
+                w2v_model = Word2Vec(
+                    sentences,
+                    corpus_file=corpus_file,
+                    window=w2v_config.window,
+                    vector_size=w2v_config.vector_size,
+                    min_count=0,
+                    workers=w2v_config.workers,
+                    epochs=w2v_config.epochs,
+                    negative=w2v_config.negative,
+                    sample=w2v_config.sample
+                )
+            finally:
+                # The corpus file is a full copy of the level's corpus
+                if corpus_file is not None and path.isfile(corpus_file):
+                    remove(corpus_file)
             w2v_model.save(w2v_model_path)
             self.logger.info("Created Word2Vec model.")
             self.logger.debug(f"Model path - {w2v_model_path}.")
@@ -153,13 +207,382 @@ class LevelwiseModel:
 
         return w2v_model
 
+    def _get_manifest(
+            self,
+            config: Config,
+            input_file: str,
+            utterances: WordToUtteranceMapping,
+            test_bench: TestBench = None,
+            hash_inputs: bool = True
+    ) -> dict:
+        """
+        Describes a level by its config, the hashes of its inputs and
+        the paths of the artifacts it produces. Without `hash_inputs`,
+        the hashes are left out, which skips a pass over the inputs
+        but means the level can never match a later checkpoint.
+        """
+        sp_model_path = config.sp_config.use_model
+        if sp_model_path is None:
+            sp_model_path = config.sp_config.get_model_name(
+                model_dir=self.__curr_model_dir
+            ) + ".model"
+        w2v_model_path = config.w2v_config.use_model
+        if w2v_model_path is None:
+            w2v_model_path = config.w2v_config.get_model_path(
+                model_dir=self.__curr_model_dir
+            )
+
+        return {
+            "config": config.to_dict(include_runtime=False),
+            "input_hash": hash_file(input_file) if hash_inputs else None,
+            "utterances_hash": utterances.get_hash() if hash_inputs else None,
+            "sp_model": sp_model_path,
+            "w2v_model": w2v_model_path,
+            "corpus": f"{self.__curr_data_dir}/corpus.txt",
+            "clusters": f"{self.__curr_data_dir}/clusters.txt",
+            "utterances": f"{self.__curr_data_dir}/utterances.txt",
+            "results": (
+                f"{self.__curr_results_dir}/results.txt"
+                if test_bench else None
+            )
+        }
+
+    def _load_checkpoint(
+            self,
+            config: Config,
+            manifest: dict
+    ) -> Union[bool, Config]:
+        """
+        Compares the checkpoint in the current level folder with
+        `manifest`. Returns True if the level is complete with the
+        same config and inputs. Otherwise returns the config to train
+        with, pointing `use_model` at checkpointed models that are
+        still valid.
+        """
+        manifest_file = f"{self.__curr_data_dir}/manifest.json"
+        if not path.isfile(manifest_file):
+            return config
+
+        with open(manifest_file, "r", encoding="utf-8") as manifest_fp:
+            saved_manifest = load(manifest_fp)
+
+        if saved_manifest == manifest and all(
+            path.isfile(manifest[key])
+            for key in [
+                "sp_model", "w2v_model", "corpus", "clusters",
+                "utterances", "results"
+            ]
+            if manifest[key] is not None
+        ):
+            return True
+
+        # Models only depend on the input corpus and their own configs
+        saved_config = saved_manifest["config"]
+        if saved_manifest["input_hash"] is None or \
+                saved_manifest["input_hash"] != manifest["input_hash"] or \
+                saved_config["sp_config"] != manifest["config"]["sp_config"] \
+                or not path.isfile(saved_manifest["sp_model"]):
+            return config
+
+        config = copy(config)
+        config.sp_config = copy(config.sp_config)
+        config.sp_config.use_model = saved_manifest["sp_model"]
+        self.logger.info("Reusing checkpointed SentencePiece model.")
+
+        if saved_config["w2v_config"] == manifest["config"]["w2v_config"] \
+                and path.isfile(saved_manifest["w2v_model"]):
+            config.w2v_config = copy(config.w2v_config)
+            config.w2v_config.use_model = saved_manifest["w2v_model"]
+            self.logger.info("Reusing checkpointed Word2Vec model.")
+
+        return config
+
+    def train_level(
+            self,
+            level: int,
+            config: Config,
+            input_file: str,
+            utterances: WordToUtteranceMapping,
+            test_bench: TestBench = None,
+            streaming: bool = False,
+            cache_corpus: bool = False,
+            resume: bool = False,
+            eval_pool: ProcessPoolExecutor = None,
+            save_embeddings: bool = False,
+            eval_workers: int = 1
+    ) -> str:
+        """
+        Trains a single level and updates `utterances` in place.
+
+        Input
+        -----
+            level : int
+                Level number, used for the level folders.
+            config : Config
+                Arguments for SentencePiece and Word2Vec at this level.
+            input_file : str
+                Filepath of the level's input corpus.
+            utterances : WordToUtteranceMapping
+                Utterances at the input of this level.
+            test_bench : TestBench, OPTIONAL
+                Test bench to evaluate the level with.
+            streaming, cache_corpus : bool, OPTIONAL
+                See `train`.
+            resume : bool, OPTIONAL
+                Whether to reuse the level's artifacts if its checkpoint
+                matches the config and inputs. (default = False)
+            eval_pool : ProcessPoolExecutor, OPTIONAL
+                Pool to run the test bench in. The level returns without
+                waiting for the results, which are written by
+                `collect_evaluations`. (default = None)
+            save_embeddings, eval_workers : OPTIONAL
+                See `train`.
+
+        Output
+        ------
+            Filepath of the corpus for the next level.
+        """
+        self.logger.info(f"----- STARTING LEVEL {level} -----")
+
+        # Create folder for level files
+        self._create_level_folders(level)
+        self.logger.info("Created level folders.")
+
+        manifest = self._get_manifest(
+            config=config,
+            input_file=input_file,
+            utterances=utterances,
+            test_bench=test_bench,
+            hash_inputs=resume
+        )
+
+        if resume:
+            checkpoint = self._load_checkpoint(config, manifest)
+            if checkpoint is True:
+                # Load the level's artifacts instead of training them
+                utterances.utterances = {}
+                utterances.load_from_file(
+                    map_file=manifest["utterances"],
+                    duplicate=False
+                )
+                utterances.split_utterances_by_dataset()
+                self.logger.info(f"Resumed level {level} from checkpoint.")
+                return manifest["corpus"]
+            config = checkpoint
+
+        # Invalidate the old checkpoint while its artifacts are rewritten
+        if path.isfile(f"{self.__curr_data_dir}/manifest.json"):
+            remove(f"{self.__curr_data_dir}/manifest.json")
+        embeddings_file = f"{self.__curr_results_dir}/embeddings.npz"
+        if path.isfile(embeddings_file):
+            remove(embeddings_file)
+        if not save_embeddings:
+            embeddings_file = None
+
+        metrics = StageMetrics()
+
+        with metrics.stage("sentencepiece") as record:
+            sp_model = self.get_sentencepiece_from_config(
+                sp_config=config.sp_config,
+                input_file=input_file
+            )
+            if config.sp_config.use_model is None:
+                # Sentences read by the trainer, before any sampling
+                record["items"] = count_lines(input_file)
+
+        encoder = PieceEncoder(
+            sp_model,
+            n_workers=config.sp_config.encode_workers,
+            batch_size=config.sp_config.encode_batch_size
+        )
+
+        # Convert input file to sentences. When streaming, encoding
+        # happens inside the Word2Vec and corpus rewrite stages.
+        with metrics.stage("encoding") as record:
+            if cache_corpus:
+                sentences = TokenIdCache(
+                    input_file,
+                    encoder,
+                    cache_dir=f"{self.__curr_data_dir}/cache"
+                )
+                record["items"] = len(sentences)
+            else:
+                sentences = EncodedCorpus(input_file, encoder)
+                corpus_ids = None
+                if not streaming:
+                    # Keep the unit ids for the corpus rewrite
+                    corpus_ids = list(sentences.iter_ids())
+                    units = np.array(encoder.units, dtype=object)
+                    sentences = [units[line].tolist() for line in corpus_ids]
+                    record["items"] = len(sentences)
+        self.logger.info("Converted input to sentences")
+        # A streamed corpus would encode a whole batch for the sample
+        if not isinstance(sentences, EncodedCorpus) and len(sentences):
+            self.logger.debug(
+                f"Sample sentence - {next(iter(sentences))[:10]}"
+            )
+
+        # Fetch Word2Vec model
+        with metrics.stage("word2vec") as record:
+            w2v_model = self.get_word2vec_from_config(
+                w2v_config=config.w2v_config,
+                sentences=sentences
+            )
+            record["items"] = w2v_model.corpus_total_words
+
+        # Perform clustering
+        with metrics.stage("clustering", items=len(w2v_model.wv)) as record:
+            cluster = Cluster(
+                model=w2v_model,
+                threshold=config.cluster_threshold,
+                index=config.neighbour_index,
+                index_args=config.neighbour_index_args,
+                method=config.cluster_method,
+                method_args=config.cluster_method_args
+            )
+            record["index_recall"] = cluster.index_recall
+
+        # Save next level corpus
+        with metrics.stage("corpus_rewrite") as record:
+            if cache_corpus:
+                record["items"] = cluster.write_corpus(
+                    manifest["corpus"], sentences
+                )
+            else:
+                record["items"] = cluster.write_corpus(
+                    manifest["corpus"],
+                    corpus_ids if corpus_ids is not None
+                    else sentences.iter_ids(),
+                    units=encoder.units
+                )
+        self.logger.info(f"Created level {level} corpus.")
+
+        # Create a function that generates vectors for an input
+        # at this level. Its encoder caches the encodings of utterances
+        # for the tests and the utterance update.
+        level_encoder = LevelEncoder(
+            encoder,
+            keyed_vectors=w2v_model.wv,
+            clusters=cluster,
+            max_size=config.sp_config.utterance_cache_size
+        )
+        word_vec_fn = LevelVectorizer(
+            sp_model_path=manifest["sp_model"],
+            keyed_vectors=w2v_model.wv,
+            encoder=level_encoder
+        )
+
+        n_utterances = len(utterances)
+
+        # Test level
+        pending_eval = None
+        if test_bench and eval_pool is not None:
+            # Snapshot the inputs now, before the utterances are updated
+            self.logger.debug("Submitting layer for testing ...")
+            pending_eval = eval_pool.submit(
+                _run_suite_snapshot,
+                dumps((
+                    test_bench,
+                    utterances,
+                    word_vec_fn,
+                    embeddings_file,
+                    eval_workers
+                ))
+            )
+        elif test_bench:
+            self.logger.debug("Testing layer ...")
+            with metrics.stage("evaluation", items=n_utterances):
+                test_bench.run_suite(
+                    utterances=utterances,
+                    word_vec_fn=word_vec_fn,
+                    results_file=manifest["results"],
+                    embeddings_file=embeddings_file,
+                    n_workers=eval_workers
+                )
+            self.logger.info("Tested layer.")
+
+        # Update utterances
+        self.logger.debug("Updating utterances ...")
+        parallel_update = config.sp_config.utterance_workers > 1
+        with metrics.stage("utterance_update", items=n_utterances) as record:
+            if parallel_update:
+                # Workers load the saved clusters and stream the updated
+                # mapping to its file
+                cluster.save_mapping(map_file=manifest["clusters"])
+                utterances.update_utterances_parallel(
+                    sp_model_path=manifest["sp_model"],
+                    cluster_file=manifest["clusters"],
+                    map_file=manifest["utterances"],
+                    n_workers=config.sp_config.utterance_workers,
+                    chunk_size=config.sp_config.utterance_chunk_size
+                )
+            else:
+                utterances.update_utterances(
+                    level_encoder,
+                    cluster
+                )
+            record["cache"] = level_encoder.get_stats()
+        self.logger.info("Updated utterances.")
+        self.logger.debug(f"Utterance cache - {record['cache']}")
+
+        # Save all files
+        with metrics.stage("saving"):
+            if not parallel_update:
+                cluster.save_mapping(map_file=manifest["clusters"])
+                utterances.save_mapping(map_file=manifest["utterances"])
+        self.logger.info("Saved cluster and utterance files.")
+
+        metrics_file = f"{self.__curr_results_dir}/metrics.json"
+        metrics.save(metrics_file)
+
+        # The manifest is written last and marks the level as complete
+        manifest_file = f"{self.__curr_data_dir}/manifest.json"
+        if pending_eval is not None:
+            self.pending_evals.append(
+                (level, pending_eval, manifest_file, manifest, metrics_file)
+            )
+        else:
+            _write_manifest(manifest_file, manifest)
+
+        return manifest["corpus"]
+
+    def collect_evaluations(self) -> None:
+        """
+        Waits for evaluations running in the background and writes
+        their results, followed by the manifests of their levels.
+        """
+        while self.pending_evals:
+            level, pending_eval, manifest_file, manifest, metrics_file = \
+                self.pending_evals.pop(0)
+            results, evaluation = pending_eval.result()
+            with open(
+                manifest["results"], "w+", encoding="utf-8"
+            ) as results_fp:
+                dump(results, results_fp)
+
+            # Evaluation was timed in the worker process
+            with open(metrics_file, "r", encoding="utf-8") as metrics_fp:
+                metrics = StageMetrics()
+                metrics.stages = load(metrics_fp)
+            metrics.stages["evaluation"] = evaluation
+            metrics.save(metrics_file)
+
+            _write_manifest(manifest_file, manifest)
+            self.logger.info(f"Tested level {level}.")
+
     def train(
             self,
             input_file: str,
             utterance_file: str,
             n_levels: int = None,
             configs: list[Config] = None,
-            test_bench: TestBench = None
+            test_bench: TestBench = None,
+            streaming: bool = False,
+            cache_corpus: bool = False,
+            resume: bool = False,
+            async_eval: bool = False,
+            save_embeddings: bool = False,
+            eval_workers: int = 1
     ) -> None:
         """
         Main training function
@@ -171,10 +594,36 @@ class LevelwiseModel:
                 per line, with maximum line length of 5000.
             configs : list
                 Arguments for SentencePiece and Word2Vec at each level.
+            streaming : bool, OPTIONAL
+                Whether to stream the encoded corpus from disk on every
+                pass instead of keeping it in memory. Trades encoding
+                time for flat memory usage. (default = False)
+            cache_corpus : bool, OPTIONAL
+                Whether to persist each level's encoded corpus as a
+                memory-mapped token id cache and read it from there.
+                Takes precedence over `streaming`. (default = False)
+            resume : bool, OPTIONAL
+                Whether to skip levels whose checkpoint manifest matches
+                their config and inputs, reusing their artifacts. Only
+                levels trained with `resume` hash their inputs, so only
+                they can be resumed later. (default = False)
+            async_eval : bool, OPTIONAL
+                Whether to run the test bench in a background process
+                while the next levels train. All results are written
+                before returning. (default = False)
+            save_embeddings : bool, OPTIONAL
+                Whether to save the utterance embedding matrix of the
+                test bench in each level's results folder, so that
+                later evaluations of the level skip embedding.
+                (default = False)
+            eval_workers : int, OPTIONAL
+                Number of processes the test bench runs its tests in,
+                sharing the embedding matrix. (default = 1)
         """
         # Load initial utterances file
         utterances = WordToUtteranceMapping()
         utterances.load_from_file(map_file=utterance_file)
+        utterances.split_utterances_by_dataset()
 
         if n_levels is None:
             if configs is None:
@@ -184,103 +633,64 @@ class LevelwiseModel:
             else:
                 n_levels = len(configs)
 
-        for level in range(1, n_levels + 1):
-            self.logger.info(f"----- STARTING LEVEL {level} -----")
-
-            # Create folder for level files
-            self._create_level_folders(level)
-            self.logger.info("Created level folders.")
-
-            # Load run config
-            config = Config()
-            if len(configs) >= level:
-                config = configs[level - 1]
-
-            sp_model = self.get_sentencepiece_from_config(
-                sp_config=config.sp_config,
-                input_file=input_file
-            )
-
-            # Convert input file to sentences
-            with open(input_file, "r", encoding="utf-8") as corpus_fp:
-                corpus = corpus_fp.readlines()
-
-            sentences = []
-            for sentence in corpus:
-                pieces = list(
-                    filter(
-                        lambda x: x != "▁",
-                        sp_model.EncodeAsPieces(sentence)
-                    )
-                )
-
-                new_pieces = [piece.replace("▁", "") for piece in pieces]
-                sentences.append(new_pieces)
-            self.logger.info("Converted input to sentences")
-            self.logger.debug(f"Sample sentence - {sentences[0][:10]}")
-
-            # Fetch Word2Vec model
-            w2v_model = self.get_word2vec_from_config(
-                w2v_config=config.w2v_config,
-                sentences=sentences
-            )
-
-            # Perform clustering
-            cluster = Cluster(
-                model=w2v_model,
-                threshold=config.cluster_threshold
-            )
-
-            # Save next level corpus
-            input_file = f"{self.__curr_data_dir}/corpus.txt"
-            with open(input_file, "w+", encoding="utf-8") as corpus_fp:
-                for line in sentences:
-                    corpus_fp.write(
-                        "".join(
-                            cluster.word_to_cluster[piece] for piece in line
-                        ) + "\n"
-                    )
-            self.logger.info(f"Created level {level} corpus.")
-
-            # Create a function that generates vectors for an input
-            # at this level
-            def word_vec_fn(word):
-                if word in w2v_model.wv.key_to_index.keys():
-                    return w2v_model.wv[word].reshape(1, -1)
-                else:
-                    pieces = list(
-                        filter(
-                            lambda x: x != "▁",
-                            sp_model.EncodeAsPieces(word)
-                        )
-                    )
-
-                    units = [piece.replace("▁", "") for piece in pieces]
-
-                    vectors = np.array([w2v_model.wv[unit] for unit in units])
-                    return vectors.mean(axis=0).reshape(1, -1)
-
-            # Test level
-            if test_bench:
-                self.logger.debug("Testing layer ...")
-                test_bench.run_suite(
+        eval_pool = None
+        if async_eval and test_bench:
+            eval_pool = ProcessPoolExecutor(max_workers=1)
+
+        try:
+            for level in range(1, n_levels + 1):
+                # Load run config
+                config = Config()
+                if configs is not None and len(configs) >= level:
+                    config = configs[level - 1]
+
+                input_file = self.train_level(
+                    level=level,
+                    config=config,
+                    input_file=input_file,
                     utterances=utterances,
-                    word_vec_fn=word_vec_fn,
-                    results_file=self.__curr_results_dir + "/results.txt"
+                    test_bench=test_bench,
+                    streaming=streaming,
+                    cache_corpus=cache_corpus,
+                    resume=resume,
+                    eval_pool=eval_pool,
+                    save_embeddings=save_embeddings,
+                    eval_workers=eval_workers
                 )
-                self.logger.info("Tested layer.")
-
-            # Update utterances
-            self.logger.debug("Updating utterances ...")
-            utterances.update_utterances(
-                sp_model,
-                cluster
-            )
-            self.logger.info("Updated utterances.")
 
-            # Save all files
-            cluster.save_mapping(map_dir=self.__curr_data_dir)
-            utterances.save_mapping(map_dir=self.__curr_data_dir)
-            self.logger.info("Saved cluster and utterance files.")
+            self.collect_evaluations()
+        finally:
+            if eval_pool is not None:
+                eval_pool.shutdown(cancel_futures=True)
 
         self.logger.info("Completed training.")
+
+
+def _run_suite_snapshot(snapshot: bytes) -> tuple[dict, dict]:
+    """
+    Runs a pickled (test bench, utterances, vector function, embeddings
+    file, number of workers) snapshot in a worker process. Returns the
+    results and the timing of the evaluation stage.
+    """
+    test_bench, utterances, word_vec_fn, embeddings_file, n_workers = \
+        loads(snapshot)
+    metrics = StageMetrics()
+    with metrics.stage(
+        "evaluation",
+        items=len(utterances)
+    ):
+        results = test_bench.run_suite(
+            utterances=utterances,
+            word_vec_fn=word_vec_fn,
+            embeddings_file=embeddings_file,
+            n_workers=n_workers
+        )
+    return results, metrics.stages["evaluation"]
+
+
+def _write_manifest(
+        manifest_file: str,
+        manifest: dict
+) -> None:
+    with open(manifest_file, "w+", encoding="utf-8") as manifest_fp:
+        dump(manifest, manifest_fp, indent=2)
@@ -0,0 +1,66 @@
+"""
+This module contains the timing and throughput instrumentation of
+the level-wise pipeline.
+"""
+from contextlib import contextmanager
+from json import dump
+from os import times
+from time import perf_counter
+
+
+class StageMetrics:
+    """
+    Collects wall time, CPU time, items processed and throughput of
+    the stages of a level. CPU time covers all threads of the current
+    process and the child processes it waited for during the stage,
+    such as the workers of a process pool shut down within it, so it
+    can exceed wall time for parallel stages.
+    """
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(
+            self,
+            name: str,
+            items: int = None
+    ):
+        """
+        Times the enclosed block as stage `name`. The number of items
+        processed can be passed in or set on the yielded record as
+        `record["items"]`.
+        """
+        record = {"items": items}
+        wall_start = perf_counter()
+        cpu_start = self._cpu_time()
+        try:
+            yield record
+        finally:
+            record["wall_time"] = perf_counter() - wall_start
+            record["cpu_time"] = self._cpu_time() - cpu_start
+            record["items_per_second"] = (
+                record["items"] / record["wall_time"]
+                if record["items"] and record["wall_time"] > 0
+                else None
+            )
+            self.stages[name] = record
+
+    @staticmethod
+    def _cpu_time() -> float:
+        """
+        Returns the user and system time of the current process and
+        of its terminated child processes.
+        """
+        cpu_times = times()
+        return cpu_times.user + cpu_times.system \
+            + cpu_times.children_user + cpu_times.children_system
+
+    def save(
+            self,
+            metrics_file: str
+    ) -> None:
+        """
+        Saves the collected stages as JSON.
+        """
+        with open(metrics_file, "w+", encoding="utf-8") as metrics_fp:
+            dump(self.stages, metrics_fp, indent=2)
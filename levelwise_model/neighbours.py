@@ -0,0 +1,270 @@
+"""
+This module contains the nearest neighbour search backends used for
+similarity lookups on a level's Word2Vec vectors.
+"""
+import numpy as np
+from gensim.models import KeyedVectors
+
+
+class NeighbourIndex:
+    """
+    Template cosine similarity index over a matrix of L2-normalised
+    vectors.
+    """
+    def __init__(
+            self,
+            vectors: np.ndarray,
+            keys: list = None
+    ):
+        self.vectors = vectors
+        self.keys = keys
+        self.key_to_index = {} if keys is None else {
+            key: index for index, key in enumerate(keys)
+        }
+
+    @classmethod
+    def from_keyed_vectors(
+            cls,
+            keyed_vectors: KeyedVectors,
+            **kwargs
+    ) -> "NeighbourIndex":
+        """
+        Builds the index over the normalised vectors of a Word2Vec
+        model.
+        """
+        return cls(
+            keyed_vectors.get_normed_vectors(),
+            keys=keyed_vectors.index_to_key,
+            **kwargs
+        )
+
+    def search(
+            self,
+            queries: np.ndarray,
+            topn: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Template function returning the indices and similarities of
+        the `topn` most similar vectors of every query row, most
+        similar first. Missing results are padded with index -1 and
+        similarity -inf.
+        """
+        pass
+
+    def most_similar(
+            self,
+            key: str,
+            topn: int = 10
+    ) -> list[tuple[str, float]]:
+        """
+        Returns the `topn` most similar keys of a key, like
+        `KeyedVectors.most_similar`.
+        """
+        row = self.key_to_index[key]
+        indices, scores = self.search(self.vectors[[row]], topn + 1)
+        return [
+            (self.keys[index], float(score))
+            for index, score in zip(indices[0], scores[0])
+            if index not in (-1, row)
+        ][:topn]
+
+    def recall(
+            self,
+            sample_size: int = 1000,
+            topn: int = 10,
+            seed: int = 0
+    ) -> float:
+        """
+        Returns the mean recall of the index against exact search for
+        the `topn` neighbours of a random sample of the vectors.
+        """
+        rng = np.random.default_rng(seed)
+        rows = rng.choice(
+            len(self.vectors),
+            size=min(sample_size, len(self.vectors)),
+            replace=False
+        )
+        found, _ = self.search(self.vectors[rows], topn + 1)
+        exact, _ = ExactIndex(self.vectors).search(
+            self.vectors[rows], topn + 1
+        )
+
+        hits = 0
+        total = 0
+        for row, row_found, row_exact in zip(rows, found, exact):
+            row_exact = set(row_exact) - {-1, row}
+            hits += len(row_exact & (set(row_found) - {-1, row}))
+            total += len(row_exact)
+        return hits / total if total else 1.0
+
+
+class ExactIndex(NeighbourIndex):
+    """
+    Exact search with one matrix product per block of query rows.
+    """
+    def __init__(
+            self,
+            vectors: np.ndarray,
+            keys: list = None,
+            block_size: int = 1024
+    ):
+        super().__init__(vectors, keys)
+        self.block_size = block_size
+
+    def search(
+            self,
+            queries: np.ndarray,
+            topn: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        indices = np.full((len(queries), topn), -1, dtype=np.int64)
+        scores = np.full((len(queries), topn), -np.inf, dtype=np.float32)
+        n_found = min(topn, len(self.vectors))
+
+        for start in range(0, len(queries), self.block_size):
+            block = queries[start:start + self.block_size]
+            similarities = block @ self.vectors.T
+            top = np.argpartition(-similarities, n_found - 1, axis=1)[
+                :, :n_found
+            ]
+            top_scores = np.take_along_axis(similarities, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            indices[start:start + len(block), :n_found] = \
+                np.take_along_axis(top, order, axis=1)
+            scores[start:start + len(block), :n_found] = \
+                np.take_along_axis(top_scores, order, axis=1)
+
+        return indices, scores
+
+
+class IVFIndex(NeighbourIndex):
+    """
+    Approximate search with an inverted file index. The vectors are
+    partitioned with spherical k-means, and a query is only compared
+    with the vectors of the `n_probe` partitions whose centroids are
+    most similar to it.
+    """
+    def __init__(
+            self,
+            vectors: np.ndarray,
+            keys: list = None,
+            n_lists: int = None,
+            n_probe: int = 8,
+            n_iter: int = 10,
+            seed: int = 0,
+            block_size: int = 65536
+    ):
+        """
+        Inputs
+        ------
+            vectors : np.ndarray
+                L2-normalised vectors to index.
+            keys : list, OPTIONAL
+                Key of every vector, for `most_similar`.
+            n_lists : int, OPTIONAL
+                Number of partitions. Defaults to the square root of the
+                number of vectors.
+            n_probe : int, OPTIONAL
+                Number of partitions searched per query. (default = 8)
+            n_iter : int, OPTIONAL
+                Number of k-means iterations. (default = 10)
+            seed : int, OPTIONAL
+                Seed of the k-means initialisation. (default = 0)
+            block_size : int, OPTIONAL
+                Number of vectors assigned to partitions at once.
+        """
+        super().__init__(vectors, keys)
+        if n_lists is None:
+            n_lists = int(np.sqrt(len(vectors)))
+        self.n_lists = max(1, min(n_lists, len(vectors)))
+        self.n_probe = min(n_probe, self.n_lists)
+        self.block_size = block_size
+
+        # Spherical k-means initialised on random vectors
+        rng = np.random.default_rng(seed)
+        self.centroids = vectors[
+            rng.choice(len(vectors), size=self.n_lists, replace=False)
+        ].copy()
+        for _ in range(n_iter):
+            assignments = self._assign(vectors)
+            order = np.argsort(assignments, kind="stable")
+            sizes = np.bincount(assignments, minlength=self.n_lists)
+            # Empty partitions keep their previous centroid
+            non_empty = sizes > 0
+            sums = np.add.reduceat(
+                vectors[order], (np.cumsum(sizes) - sizes)[non_empty], axis=0
+            )
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            self.centroids[non_empty] = sums / np.maximum(
+                norms, np.finfo(np.float32).tiny
+            )
+
+        # Inverted lists as one array of members with offsets
+        assignments = self._assign(vectors)
+        self.members = np.argsort(assignments, kind="stable")
+        self.offsets = np.concatenate([
+            [0],
+            np.cumsum(np.bincount(assignments, minlength=self.n_lists))
+        ])
+
+    def _assign(
+            self,
+            vectors: np.ndarray
+    ) -> np.ndarray:
+        return np.concatenate([
+            np.argmax(
+                vectors[start:start + self.block_size] @ self.centroids.T,
+                axis=1
+            )
+            for start in range(0, len(vectors), self.block_size)
+        ])
+
+    def search(
+            self,
+            queries: np.ndarray,
+            topn: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        indices = np.full((len(queries), topn), -1, dtype=np.int64)
+        scores = np.full((len(queries), topn), -np.inf, dtype=np.float32)
+
+        probes = np.argpartition(
+            -(queries @ self.centroids.T), self.n_probe - 1, axis=1
+        )[:, :self.n_probe]
+
+        for query_idx, query in enumerate(queries):
+            candidates = np.concatenate([
+                self.members[self.offsets[probe]:self.offsets[probe + 1]]
+                for probe in probes[query_idx]
+            ])
+            similarities = self.vectors[candidates] @ query
+            n_found = min(topn, len(candidates))
+            if n_found == 0:
+                continue
+            top = np.argpartition(-similarities, n_found - 1)[:n_found]
+            top = top[np.argsort(-similarities[top], kind="stable")]
+            indices[query_idx, :n_found] = candidates[top]
+            scores[query_idx, :n_found] = similarities[top]
+
+        return indices, scores
+
+
+neighbour_indices = {
+    "exact": ExactIndex,
+    "ivf": IVFIndex
+}
+
+
+def get_neighbour_index(
+        name: str,
+        vectors: np.ndarray,
+        keys: list = None,
+        **kwargs
+) -> NeighbourIndex:
+    """
+    Builds a neighbour index by name ("exact" or "ivf").
+    """
+    if name not in neighbour_indices:
+        raise ValueError(
+            f"Unknown neighbour index `{name}`. "
+            f"Use one of {list(neighbour_indices)}."
+        )
+    return neighbour_indices[name](vectors, keys=keys, **kwargs)
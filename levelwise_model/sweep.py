@@ -0,0 +1,211 @@
+"""
+This module contains the sweep runner that trains several level-wise
+model configurations while sharing their common levels.
+"""
+import logging
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from hashlib import sha256
+from json import dumps
+from os import makedirs
+
+from levelwise_model.config import Config
+from levelwise_model.corpus import hash_file
+from levelwise_model.levelwise_model import LevelwiseModel
+from levelwise_model.test_bench import TestBench
+from levelwise_model.utterances import WordToUtteranceMapping
+
+
+class LevelwiseSweep:
+    """
+    Trains a list of config chains as a prefix tree. Every unique
+    prefix of level configs is trained exactly once, in its own folder
+    named after the hash of the prefix and of the inputs, and is
+    reused by every chain that starts with it. Every prefix is trained
+    as soon as its parent prefix has finished, so independent branches
+    train concurrently.
+    """
+    def __init__(
+            self,
+            sweep_dir: str = "sweeps/",
+            n_workers: int = 4
+    ):
+        """
+        Inputs
+        ------
+            sweep_dir : str, OPTIONAL
+                Directory holding one folder per trained prefix.
+            n_workers : int, OPTIONAL
+                Number of prefixes trained at the same time.
+                (default = 4)
+        """
+        self.sweep_dir = sweep_dir.strip("/")
+        self.n_workers = n_workers
+
+        self.logger = logging.getLogger("LevelwiseSweep")
+        self.logger.setLevel("DEBUG")
+
+    def _prefix_key(
+            self,
+            inputs_hash: str,
+            configs: list[Config]
+    ) -> str:
+        """
+        Returns the key of a prefix of level configs.
+        """
+        return sha256(
+            dumps(
+                {
+                    "inputs": inputs_hash,
+                    "configs": [
+                        config.to_dict(include_runtime=False)
+                        for config in configs
+                    ]
+                },
+                sort_keys=True
+            ).encode()
+        ).hexdigest()[:16]
+
+    def run(
+            self,
+            input_file: str,
+            utterance_file: str,
+            chains: list[list[Config]],
+            test_bench: TestBench = None,
+            streaming: bool = False,
+            cache_corpus: bool = False
+    ) -> list[list[str]]:
+        """
+        Trains all chains.
+
+        Inputs
+        ------
+            input_file : str
+                Filepath of the level 0 corpus.
+            utterance_file : str
+                Filepath of the level 0 utterances.
+            chains : list
+                Lists of level configs, one per model.
+            test_bench : TestBench, OPTIONAL
+                Test bench to evaluate every level with.
+            streaming, cache_corpus : bool, OPTIONAL
+                See `LevelwiseModel.train`.
+
+        Output
+        ------
+            For every chain, the data folders of its levels. Each folder
+            contains the level's `manifest.json`.
+        """
+        inputs_hash = hash_file(input_file) + hash_file(utterance_file)
+
+        # Prefix tree, keyed by prefix key
+        nodes = {}
+        for chain in chains:
+            parent = None
+            for depth in range(1, len(chain) + 1):
+                key = self._prefix_key(inputs_hash, chain[:depth])
+                if key not in nodes:
+                    nodes[key] = {
+                        "level": depth,
+                        "config": chain[depth - 1],
+                        "children": []
+                    }
+                    if parent is not None:
+                        nodes[parent]["children"].append(key)
+                parent = key
+        self.logger.info(f"Training {len(nodes)} unique prefixes.")
+
+        # Data folder of every trained prefix, keyed by prefix key
+        level_dirs = {}
+        with ProcessPoolExecutor(max_workers=self.n_workers) as pool:
+            def submit(key: str, parent_dir: str = None):
+                return pool.submit(
+                    _train_prefix,
+                    node_dir=f"{self.sweep_dir}/{key}",
+                    level=nodes[key]["level"],
+                    config=nodes[key]["config"],
+                    input_file=(
+                        input_file if parent_dir is None
+                        else f"{parent_dir}/corpus.txt"
+                    ),
+                    utterance_file=(
+                        utterance_file if parent_dir is None
+                        else f"{parent_dir}/utterances.txt"
+                    ),
+                    test_bench=test_bench,
+                    streaming=streaming,
+                    cache_corpus=cache_corpus
+                )
+
+            pending = {
+                submit(key): key
+                for key, node in nodes.items() if node["level"] == 1
+            }
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for job in done:
+                    # Start the children of a prefix once it is trained
+                    key = pending.pop(job)
+                    level_dirs[key] = job.result()
+                    for child in nodes[key]["children"]:
+                        pending[submit(child, level_dirs[key])] = child
+
+        return [
+            [
+                level_dirs[self._prefix_key(inputs_hash, chain[:depth])]
+                for depth in range(1, len(chain) + 1)
+            ]
+            for chain in chains
+        ]
+
+
+def _train_prefix(
+        node_dir: str,
+        level: int,
+        config: Config,
+        input_file: str,
+        utterance_file: str,
+        test_bench: TestBench = None,
+        streaming: bool = False,
+        cache_corpus: bool = False
+) -> str:
+    """
+    Trains the last level of a prefix in a worker process, skipping it
+    if its checkpoint is already complete. Returns the level's data
+    folder.
+    """
+    makedirs(node_dir, exist_ok=True)
+    model = LevelwiseModel(
+        model_dir=f"{node_dir}/models/",
+        data_dir=f"{node_dir}/data/",
+        log_dir=f"{node_dir}/logs/",
+        results_dir=f"{node_dir}/results/"
+    )
+
+    # Level 0 utterances are duplicated on load as in `train`, saved
+    # ones already contain the duplicates
+    utterances = WordToUtteranceMapping()
+    utterances.load_from_file(
+        map_file=utterance_file,
+        duplicate=(level == 1)
+    )
+    utterances.split_utterances_by_dataset()
+
+    try:
+        model.train_level(
+            level=level,
+            config=config,
+            input_file=input_file,
+            utterances=utterances,
+            test_bench=test_bench,
+            streaming=streaming,
+            cache_corpus=cache_corpus,
+            resume=True
+        )
+    finally:
+        # Worker processes are reused, do not leak this node's log file
+        # into the next one
+        for handler in list(model.logger.handlers):
+            model.logger.removeHandler(handler)
+            handler.close()
+
+    return f"{node_dir}/data/level{level}"
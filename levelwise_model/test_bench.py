@@ -1,11 +1,88 @@
+from concurrent.futures import ProcessPoolExecutor
 from json import dump
 from string import ascii_letters
+from typing import Iterable, Iterator
+from zlib import crc32
 
 import numpy as np
-from scipy.stats import pearsonr
+from scipy.stats import norm, pearsonr
 from sklearn.metrics.pairwise import cosine_similarity
 
-from levelwise_model.utterances import WordToUtteranceMapping
+from levelwise_model.embeddings import UtteranceEmbeddings
+from levelwise_model.utterances import (
+    UtteranceView,
+    WordToUtteranceMapping
+)
+
+
+def wilson_interval(
+        successes: int,
+        trials: int,
+        confidence: float = 0.95
+) -> tuple[float, float]:
+    """
+    Returns the Wilson score interval of a binomial proportion.
+    """
+    if trials == 0:
+        return 0.0, 1.0
+    z = norm.ppf(0.5 + confidence / 2)
+    p = successes / trials
+    denominator = 1 + z ** 2 / trials
+    centre = (p + z ** 2 / (2 * trials)) / denominator
+    half_width = z * np.sqrt(
+        p * (1 - p) / trials + z ** 2 / (4 * trials ** 2)
+    ) / denominator
+    return float(max(0.0, centre - half_width)), \
+        float(min(1.0, centre + half_width))
+
+
+# Utterance views of the same-word ABX test sets
+_SAME_WORD_SETS = {
+    "librispeech": "ls_utterances",
+    "synthetic": "sy_utterances",
+    "mixed": "mixed_utterances"
+}
+
+
+def _test_set_of(word: str) -> str:
+    if word.startswith("ls_"):
+        return "librispeech"
+    if word.startswith("sy_"):
+        return "synthetic"
+    return "other"
+
+
+def _trial_rng(
+        seed: int,
+        test: str,
+        test_set: str
+) -> np.random.Generator:
+    """
+    Returns the generator of the trials of a test set, seeded from
+    `seed` and the names of the test and test set, so every test set
+    draws the same trials in whichever process or order it runs.
+    """
+    if seed is None:
+        return np.random.default_rng()
+    return np.random.default_rng(
+        [seed, crc32(f"{test}/{test_set}".encode())]
+    )
+
+
+def _abx_correct(
+        normed: np.ndarray,
+        row_a: np.ndarray,
+        row_b: np.ndarray,
+        row_x: np.ndarray
+) -> np.ndarray:
+    """
+    Returns whether every A is closer to its B than to its X, given
+    their rows of an L2-normalised matrix.
+    """
+    # Cosine similarities as row-wise dot products
+    sim_ab = np.einsum("ij,ij->i", normed[row_a], normed[row_b])
+    sim_ax = np.einsum("ij,ij->i", normed[row_a], normed[row_x])
+    return sim_ab > sim_ax
 
 
 class TestBench:
@@ -23,7 +100,9 @@ class TestBench:
 
     def run_suite(
             self,
-            results_file: str = None
+            results_file: str = None,
+            embeddings_file: str = None,
+            n_workers: int = 1
     ):
         """
         Template function to run all tests.
@@ -51,6 +130,10 @@ class LSTestBench(TestBench):
         Loads scores from the LibriSpeech dataset.
         The file consists of rows of the format:
             word1,word2,similarity_score,relationness_score
+
+        Also indexes the relatedness pairs by word: `partners` maps
+        every word to an array of the other words of its pairs, most
+        related first, and `partner_scores` to their scores.
         """
         self.sim_pairs = []
         self.rel_pairs = []
@@ -63,16 +146,39 @@ class LSTestBench(TestBench):
                 if rel:
                     self.rel_pairs.append((w1, w2, float(rel)))
 
+        pairs_by_word = {}
+        for w1, w2, rel in self.rel_pairs:
+            pairs_by_word.setdefault(w1, []).append((w2, rel))
+            if w2 != w1:
+                pairs_by_word.setdefault(w2, []).append((w1, rel))
+
+        self.partners = {}
+        self.partner_scores = {}
+        for word, pairs in pairs_by_word.items():
+            # Stable sort keeps equally related words in file order
+            pairs = sorted(pairs, key=lambda x: x[1], reverse=True)
+            self.partners[word] = np.array([pair[0] for pair in pairs])
+            self.partner_scores[word] = np.array(
+                [pair[1] for pair in pairs], dtype=np.float64
+            )
+
     def similarity_score_test(
             self,
             utterances: WordToUtteranceMapping,
-            word_vec_fn: callable
+            word_vec_fn: callable,
+            embeddings: UtteranceEmbeddings = None,
+            verify: bool = False
     ):
         """
         Uses similarity scores from the given pairs list
         and finds correlation between similarities provided by
         the callable.
 
+        The similarity of two words is the mean cosine similarity
+        of all pairs of their utterances. It is computed as the dot
+        product of the means of the words' L2-normalised utterance
+        vectors, which is equal and computed once per word.
+
         This function is specific for the format the pairs are
         set in.
 
@@ -83,7 +189,29 @@ class LSTestBench(TestBench):
             word_vec_fn : callable
                 A function that returns embeddings for a
                 string input.
+            embeddings : UtteranceEmbeddings, OPTIONAL
+                Embedded utterances. Built with `word_vec_fn` if
+                not given.
+            verify : bool, OPTIONAL
+                Whether to also compute every score from the pairwise
+                cosine similarities and raise an AssertionError if
+                they differ. (default = False)
         """
+        if embeddings is None:
+            embeddings = UtteranceEmbeddings(utterances, word_vec_fn)
+
+        # Mean normalised utterance vector of every word
+        means = {}
+
+        def __get_mean(word):
+            if word not in means:
+                rows = embeddings.rows_of(utterances.utterances[word])
+                embeddings.check(rows)
+                means[word] = embeddings.normed[rows].mean(
+                    axis=0, dtype=np.float64
+                )
+            return means[word]
+
         scores = {
             test_set: []
             for test_set in ["librispeech", "synthetic"]
@@ -103,25 +231,33 @@ class LSTestBench(TestBench):
                     if w1.startswith("ls_") \
                     else "synthetic"
 
-                # Get vectors
-                w1_vectors = np.array(
-                    [word_vec_fn(utt) for utt in utterances.utterances[w1]]
-                )
-                w2_vectors = np.array(
-                    [word_vec_fn(utt) for utt in utterances.utterances[w2]]
-                )
+                # Mean similarity between each pair
+                score = float(__get_mean(w1) @ __get_mean(w2))
 
-                # Compute similarities between each pair
-                similarities = [
-                    cosine_similarity(i, j)
-                    for i in w1_vectors
-                    for j in w2_vectors
-                ]
+                if verify:
+                    similarities = cosine_similarity(
+                        embeddings.matrix[
+                            embeddings.rows_of(utterances.utterances[w1])
+                        ],
+                        embeddings.matrix[
+                            embeddings.rows_of(utterances.utterances[w2])
+                        ]
+                    )
+                    np.testing.assert_allclose(
+                        score,
+                        np.mean(similarities),
+                        rtol=1e-5,
+                        atol=1e-6,
+                        err_msg=f"Similarity of {w1} and {w2}"
+                    )
 
                 # Append scores
-                scores[test_set].append(np.mean(similarities))
+                scores[test_set].append(score)
                 gold_standard[test_set].append(rel)
 
+            except AssertionError:
+                raise
+
             except Exception as e:
                 print(e)
                 errors += 1
@@ -142,17 +278,180 @@ class LSTestBench(TestBench):
             'trials': trials
         }
 
+    def _run_trials(
+            self,
+            draw: callable,
+            n_trials: int,
+            adaptive: bool = False,
+            ci_width: float = 0.02,
+            max_trials: int = 100000,
+            batch_size: int = None,
+            confidence: float = 0.95
+    ) -> tuple[int, int]:
+        """
+        Runs batches of trials with `draw`, which takes a number of
+        trials and returns whether each succeeded. Runs `n_trials`
+        trials, or if `adaptive`, stops as soon as the Wilson interval
+        of the success rate is at most `ci_width` wide or `max_trials`
+        trials have run. Returns the successes and the trials.
+        """
+        if batch_size is None:
+            batch_size = 1000 if adaptive else 65536
+        if adaptive:
+            n_trials = max_trials
+
+        successes = 0
+        trials = 0
+        while trials < n_trials:
+            outcomes = draw(min(batch_size, n_trials - trials))
+            successes += int(np.count_nonzero(outcomes))
+            trials += len(outcomes)
+            low, high = wilson_interval(successes, trials, confidence)
+            if adaptive and high - low <= ci_width:
+                break
+
+        return successes, trials
+
+    def _abx_result(
+            self,
+            name: str,
+            counts: dict,
+            adaptive: bool = False,
+            confidence: float = 0.95
+    ) -> dict:
+        """
+        Formats the (successes, trials) counts of every test set as the
+        accuracies of an ABX test, adding their intervals and trial
+        counts if `adaptive`.
+        """
+        results = {
+            test_set: successes / trials
+            for test_set, (successes, trials) in counts.items()
+        }
+        if not adaptive:
+            return {
+                name: results
+            }
+        return {
+            name: results,
+            "intervals": {
+                test_set: wilson_interval(*test_counts, confidence)
+                for test_set, test_counts in counts.items()
+            },
+            "trials": {
+                test_set: trials
+                for test_set, (_, trials) in counts.items()
+            }
+        }
+
+    def _same_word_index(
+            self,
+            dataset: UtteranceView,
+            embeddings: UtteranceEmbeddings
+    ) -> dict:
+        """
+        Indexes the utterance rows of a dataset view for sampling. The
+        rows of word `i` are `rows[starts[i]:starts[i] + counts[i]]`.
+        Words with at least two utterances can be A, words with at
+        least one can be X.
+        """
+        rows = [embeddings.rows_of(dataset[word]) for word in dataset]
+        counts = np.array([len(word_rows) for word_rows in rows], np.int64)
+        rows = np.concatenate(rows or [np.zeros(0, dtype=np.int64)])
+        return {
+            "rows": rows,
+            "starts": np.cumsum(counts) - counts,
+            "counts": counts,
+            "a_words": np.flatnonzero(counts >= 2),
+            "x_words": np.flatnonzero(counts >= 1)
+        }
+
+    def _same_word_trials(
+            self,
+            index: dict,
+            embeddings: UtteranceEmbeddings,
+            rng: np.random.Generator,
+            n_trials: int
+    ) -> np.ndarray:
+        """
+        Draws `n_trials` (A, B, X) triplets at once and returns whether
+        each was a success, i.e. A was closer to B than to X.
+        """
+        starts = index["starts"]
+        counts = index["counts"]
+        x_words = index["x_words"]
+
+        # Word A, and word X among the other words
+        word_a = rng.choice(index["a_words"], size=n_trials)
+        x_pos = rng.integers(len(x_words) - 1, size=n_trials)
+        x_pos += x_pos >= np.searchsorted(x_words, word_a)
+        word_x = x_words[x_pos]
+
+        # Two distinct utterances of A and one of X
+        utt_a = rng.integers(counts[word_a])
+        utt_b = rng.integers(counts[word_a] - 1)
+        utt_b += utt_b >= utt_a
+        utt_x = rng.integers(counts[word_x])
+
+        row_a = index["rows"][starts[word_a] + utt_a]
+        row_b = index["rows"][starts[word_a] + utt_b]
+        row_x = index["rows"][starts[word_x] + utt_x]
+        embeddings.check(np.concatenate([row_a, row_b, row_x]))
+
+        return _abx_correct(embeddings.normed, row_a, row_b, row_x)
+
+    def _same_word_counts(
+            self,
+            utterances: WordToUtteranceMapping,
+            word_vec_fn: callable,
+            embeddings: UtteranceEmbeddings,
+            test_set: str,
+            runs_per_ds: int = 700,
+            seed: int = None,
+            batch_size: int = None,
+            adaptive: bool = False,
+            ci_width: float = 0.02,
+            max_trials: int = 100000,
+            confidence: float = 0.95
+    ) -> tuple[int, int]:
+        """
+        Runs the same-word ABX trials of one test set ("librispeech",
+        "synthetic" or "mixed"). Returns the successes and the trials.
+        """
+        index = self._same_word_index(
+            getattr(utterances, _SAME_WORD_SETS[test_set]), embeddings
+        )
+        rng = _trial_rng(seed, "same-word", test_set)
+        return self._run_trials(
+            lambda n: self._same_word_trials(index, embeddings, rng, n),
+            n_trials=runs_per_ds,
+            adaptive=adaptive,
+            ci_width=ci_width,
+            max_trials=max_trials,
+            batch_size=batch_size,
+            confidence=confidence
+        )
+
     def same_word_abx_test(
             self,
             utterances: WordToUtteranceMapping,
             word_vec_fn: callable,
             runs_per_ds: int = 700,
-            use_noise_for_x: bool = False
+            use_noise_for_x: bool = False,
+            embeddings: UtteranceEmbeddings = None,
+            seed: int = None,
+            batch_size: int = None,
+            adaptive: bool = False,
+            ci_width: float = 0.02,
+            max_trials: int = 100000,
+            confidence: float = 0.95
     ):
         """
         Performs ABX testing with all the words in the utterance
-        vocaulary. For each word, a test is only done if there are
-        at least two other word similarities available for it.
+        vocaulary. Each trial draws a word A with two different
+        utterances A and B, and an utterance X of another word, and
+        succeeds if A is closer to B than to X. Trials are drawn and
+        scored in batches.
 
         Inputs
         ------
@@ -161,155 +460,218 @@ class LSTestBench(TestBench):
             word_vec_fn : callable
                 A function that returns embeddings for a
                 string input.
+            runs_per_ds : int, OPTIONAL
+                Number of trials per dataset. (default = 700)
             use_noise_for_x : bool
                 Whether to randomly generate word X. `false`
                 uses the word with least similarity with
                 word A instead. (default = False)
+            embeddings : UtteranceEmbeddings, OPTIONAL
+                Embedded utterances. Built with `word_vec_fn` if
+                not given.
+            seed : int, OPTIONAL
+                Seed of the trial generator. (default = None)
+            batch_size : int, OPTIONAL
+                Number of trials scored at once. Defaults to 65536,
+                or 1000 if `adaptive`.
+            adaptive : bool, OPTIONAL
+                Whether to run trials until the confidence interval
+                of each dataset is at most `ci_width` wide, or
+                `max_trials` trials have run, instead of running
+                `runs_per_ds` trials. The intervals and trial counts
+                are added to the results. (default = False)
+            ci_width : float, OPTIONAL
+                Target width of the intervals. (default = 0.02)
+            max_trials : int, OPTIONAL
+                Maximum number of trials per dataset.
+                (default = 100000)
+            confidence : float, OPTIONAL
+                Confidence level of the Wilson score intervals.
+                (default = 0.95)
         """
-        test_sets = {
-            'librispeech': {
-                'preds': 0,
-                'total': 0,
-                'dataset': utterances.ls_utterances
-            },
-            'synthetic': {
-                'preds': 0,
-                'total': 0,
-                'dataset': utterances.sy_utterances
-            },
-            'mixed': {
-                'preds': 0,
-                'total': 0,
-                'dataset': utterances.mixed_utterances
-            },
+        if embeddings is None:
+            embeddings = UtteranceEmbeddings(utterances, word_vec_fn)
+
+        counts = {
+            test_set: self._same_word_counts(
+                utterances,
+                word_vec_fn,
+                embeddings,
+                test_set,
+                runs_per_ds=runs_per_ds,
+                seed=seed,
+                batch_size=batch_size,
+                adaptive=adaptive,
+                ci_width=ci_width,
+                max_trials=max_trials,
+                confidence=confidence
+            )
+            for test_set in _SAME_WORD_SETS
         }
+        return self._abx_result(
+            "Same-word ABX Result", counts, adaptive, confidence
+        )
 
-        preds = 0
-        total = 0
+    def _cross_word_index(
+            self,
+            utterances: WordToUtteranceMapping,
+            embeddings: UtteranceEmbeddings,
+            test_set: str
+    ) -> dict:
+        """
+        Indexes the utterance rows of the words A of a test set that
+        have a word B and a different word X, for sampling. Every A
+        utterance row is stored with the position of its word, whose B
+        rows are `b_rows[b_starts[i]:b_starts[i] + b_counts[i]]`, and
+        likewise for X.
+        """
+        index = {
+            name: [] for name in ["a_rows", "a_words", "b_rows", "x_rows"]
+        }
+        b_counts, x_counts = [], []
+        for word_a, utts in utterances.utterances.items():
+            similar_words = self.partners.get(word_a)
+            if _test_set_of(word_a) != test_set or similar_words is None:
+                continue
+            word_b, word_x = similar_words[0], similar_words[-1]
+            if len(set([word_a, word_b, word_x])) != 3:
+                continue
 
-        for test_set in test_sets:
-            ds = test_sets[test_set]['dataset']
-            for _ in range(runs_per_ds):
-                # Select two random words for A and X
-                word_a, word_x = np.random.choice(
-                    list(ds.keys()),
-                    size=2,
-                    replace=False
-                )
-                utt_a, utt_b = np.random.choice(
-                    ds[word_a],
-                    size=2,
-                    replace=False
-                )
+            a_rows = embeddings.rows_of(utts)
+            index["a_rows"].append(a_rows)
+            index["a_words"].append(np.full(len(a_rows), len(b_counts)))
+            index["b_rows"].append(
+                embeddings.rows_of(utterances.utterances[word_b])
+            )
+            index["x_rows"].append(
+                embeddings.rows_of(utterances.utterances[word_x])
+            )
+            b_counts.append(len(index["b_rows"][-1]))
+            x_counts.append(len(index["x_rows"][-1]))
 
-                utt_x = np.random.choice(
-                    ds[word_x]
-                )
+        index = {
+            name: np.concatenate(rows or [np.zeros(0, dtype=np.int64)])
+            for name, rows in index.items()
+        }
+        for name, counts in [("b", b_counts), ("x", x_counts)]:
+            counts = np.array(counts, dtype=np.int64)
+            index[f"{name}_starts"] = np.cumsum(counts) - counts
+            index[f"{name}_counts"] = counts
+        return index
 
-                v_a = word_vec_fn(utt_a)
-                v_b = word_vec_fn(utt_b)
-                v_x = word_vec_fn(utt_x)
+    def _cross_word_trials(
+            self,
+            index: dict,
+            embeddings: UtteranceEmbeddings,
+            rng: np.random.Generator,
+            n_trials: int
+    ) -> np.ndarray:
+        """
+        Draws `n_trials` (A, B, X) triplets at once, with A uniform
+        over the indexed utterances and B and X uniform over the
+        utterances of its words, and returns whether each was a
+        success, i.e. A was closer to B than to X.
+        """
+        utt_a = rng.integers(len(index["a_rows"]), size=n_trials)
+        word_a = index["a_words"][utt_a]
 
-                sim_ab = cosine_similarity(v_a, v_b)
-                sim_ax = cosine_similarity(v_a, v_x)
+        row_a = index["a_rows"][utt_a]
+        row_b = index["b_rows"][
+            index["b_starts"][word_a]
+            + rng.integers(index["b_counts"][word_a])
+        ]
+        row_x = index["x_rows"][
+            index["x_starts"][word_a]
+            + rng.integers(index["x_counts"][word_a])
+        ]
+        embeddings.check(np.concatenate([row_a, row_b, row_x]))
 
-                if sim_ab > sim_ax:
-                    # If model predicts A and B to be closer
-                    # than A and x, it is a success
-                    preds += 1
-                    test_sets[test_set]['preds'] += 1
-                total += 1
-                test_sets[test_set]['total'] += 1
+        return _abx_correct(embeddings.normed, row_a, row_b, row_x)
 
-        return {
-            "Same-word ABX Result": {
-                test_set: (
-                    test_sets[test_set]['preds'] /
-                    test_sets[test_set]['total']
-                )
-                for test_set in test_sets
-            }
-        }
+    def _cross_word_sets(
+            self,
+            adaptive: bool = False
+    ) -> list[str]:
+        """
+        Returns the test sets of the words A of the cross-word ABX test.
+        Words of neither dataset only count towards the combined result
+        of the exhaustive test.
+        """
+        if adaptive:
+            return ["librispeech", "synthetic"]
+        return ["librispeech", "synthetic", "other"]
 
-    def cross_word_abx_test(
+    def _cross_word_counts(
             self,
             utterances: WordToUtteranceMapping,
             word_vec_fn: callable,
+            embeddings: UtteranceEmbeddings,
+            test_set: str,
             use_noise_for_x: bool = False,
-    ):
+            adaptive: bool = False,
+            seed: int = None,
+            ci_width: float = 0.02,
+            max_trials: int = 100000,
+            batch_size: int = None,
+            confidence: float = 0.95
+    ) -> tuple[int, int]:
         """
-        Performs ABX testing with all the words in the utterance
-        vocaulary. For each word, a test is only done if there are
-        at least two other word similarities available for it.
-
-        Inputs
-        ------
-            utterances : WordToUtteranceMapping
-                To fetch the utterances of each word.
-            word_vec_fn : callable
-                A function that returns embeddings for a
-                string input.
-            use_noise_for_x : bool, OPTIONAL
-                Whether to randomly generate word X. `false`
-                uses the word with least similarity with
-                word A instead. (default = False)
+        Runs the cross-word ABX trials of the words A of one test set
+        ("librispeech", "synthetic" or "other"). Returns the successes
+        and the trials.
         """
-        ls_preds = 0
-        sy_preds = 0
-        ls_total = 0
-        sy_total = 0
+        rng = _trial_rng(seed, "cross-word", test_set)
+        if adaptive:
+            if use_noise_for_x:
+                raise ValueError(
+                    "Adaptive cross-word ABX does not support noise for X."
+                )
+            index = self._cross_word_index(utterances, embeddings, test_set)
+            if not len(index["a_rows"]):
+                raise ValueError(f"No cross-word ABX trials for `{test_set}`.")
+            return self._run_trials(
+                lambda n: self._cross_word_trials(index, embeddings, rng, n),
+                n_trials=max_trials,
+                adaptive=True,
+                ci_width=ci_width,
+                max_trials=max_trials,
+                batch_size=batch_size,
+                confidence=confidence
+            )
+
         preds = 0
         total = 0
 
-        def __get_other_word(pair, word):
-            """
-            Custom function to return the other word given
-            a pair
-            """
-            if pair[0] == word:
-                return pair[1]
-            return pair[1]
-
         for word_a in utterances.utterances:
-            # Sort words by similarity
-            similar_words = sorted(
-                # Get only pairs containing word A
-                filter(
-                    lambda x: x[0] == word_a or x[1] == word_a,
-                    self.rel_pairs
-                ),
-                key=lambda x: x[2],
-                reverse=True
-            )
-
-            # Get the other words (the one that isn't word A from pair)
-            similar_words = list(
-                map(
-                    lambda x: __get_other_word(x, word_a),
-                    similar_words
-                )
-            )
+            # Other words of the pairs containing word A, most related
+            # first. Words without pairs are not tested.
+            similar_words = self.partners.get(word_a)
+            if _test_set_of(word_a) != test_set or similar_words is None:
+                continue
 
             # For all utterances of the word
-            for utt_a in utterances.utterances[word_a]:
+            for utt_a, row_a in zip(
+                utterances.utterances[word_a],
+                embeddings.rows_of(utterances.utterances[word_a])
+            ):
                 # Word B is most similar word
                 word_b = similar_words[0]  # TODO: Change to sample from top n%
                 # Use random utterance
-                utt_b = np.random.choice(
-                    utterances.utterances[word_b]
+                row_b = rng.choice(
+                    embeddings.rows_of(utterances.utterances[word_b])
                 )
 
                 if not use_noise_for_x:
                     # Word X is least similar word
                     word_x = similar_words[-1]
                     # Use random utterance
-                    utt_x = np.random.choice(
-                        utterances.utterances[word_x]
+                    row_x = rng.choice(
+                        embeddings.rows_of(utterances.utterances[word_x])
                     )
                 else:
                     word_x = "noise"  # Placeholder word
                     # Generate noise
-                    utt_x = np.random.choice(
+                    utt_x = rng.choice(
                         list(ascii_letters),
                         len(utt_a),
                         replace=True
@@ -318,40 +680,139 @@ class LSTestBench(TestBench):
 
                 # TODO: Perform this check before indexing
                 if len(set([word_a, word_b, word_x])) == 3:
-                    v_a = word_vec_fn(utt_a)
-                    v_b = word_vec_fn(utt_b)
-                    v_x = word_vec_fn(utt_x)
+                    embeddings.check(np.array([row_a, row_b]))
+                    v_a, v_b = embeddings.matrix[[row_a, row_b], None]
+                    if use_noise_for_x:
+                        v_x = word_vec_fn(utt_x)
+                    else:
+                        embeddings.check(np.array([row_x]))
+                        v_x = embeddings.matrix[[row_x]]
 
                     sim_ab = cosine_similarity(v_a, v_b)
                     sim_ax = cosine_similarity(v_a, v_x)
 
                     if sim_ab > sim_ax:
-                        if word_a.startswith("ls_"):
-                            ls_preds += 1
-                        elif word_a.startswith("sy_"):
-                            sy_preds += 1
                         # If model predicts A and B to be closer
                         # than A and x, it is a success
                         preds += 1
-                    if word_a.startswith("ls_"):
-                        ls_total += 1
-                    elif word_a.startswith("sy_"):
-                        sy_total += 1
                     total += 1
 
-        return {
-            "ABX Result": {
-                'librispeech': ls_preds / ls_total,
-                'synthetic': sy_preds / sy_total,
-                'combined': preds / total
-            }
+        return preds, total
+
+    def _cross_word_result(
+            self,
+            counts: dict,
+            adaptive: bool = False,
+            confidence: float = 0.95
+    ) -> dict:
+        """
+        Formats the counts of the cross-word ABX test sets, pooling all
+        of them into the combined result of the exhaustive test.
+
+        The adaptive test leaves out the combined result: its pooled
+        counts would weight each test set by the trials it happened to
+        need rather than by its utterances, and no run controls the
+        width of its interval.
+        """
+        results = {
+            "librispeech": counts["librispeech"],
+            "synthetic": counts["synthetic"]
+        }
+        if not adaptive:
+            results["combined"] = (
+                sum(successes for successes, _ in counts.values()),
+                sum(trials for _, trials in counts.values())
+            )
+        return self._abx_result("ABX Result", results, adaptive, confidence)
+
+    def cross_word_abx_test(
+            self,
+            utterances: WordToUtteranceMapping,
+            word_vec_fn: callable,
+            use_noise_for_x: bool = False,
+            embeddings: UtteranceEmbeddings = None,
+            adaptive: bool = False,
+            seed: int = None,
+            ci_width: float = 0.02,
+            max_trials: int = 100000,
+            batch_size: int = None,
+            confidence: float = 0.95
+    ):
+        """
+        Performs ABX testing with all the words in the utterance
+        vocaulary. For each word, a test is only done if there are
+        at least two other word similarities available for it.
+
+        Inputs
+        ------
+            utterances : WordToUtteranceMapping
+                To fetch the utterances of each word.
+            word_vec_fn : callable
+                A function that returns embeddings for a
+                string input.
+            use_noise_for_x : bool, OPTIONAL
+                Whether to randomly generate word X. `false`
+                uses the word with least similarity with
+                word A instead. (default = False)
+            embeddings : UtteranceEmbeddings, OPTIONAL
+                Embedded utterances. Built with `word_vec_fn` if
+                not given. Noise is embedded with `word_vec_fn`.
+            adaptive : bool, OPTIONAL
+                Whether to sample trials in batches of `batch_size`
+                (default 1000) instead of testing every utterance of
+                every word, until the confidence interval of each
+                dataset is at most `ci_width` wide, or `max_trials`
+                trials have run. Utterances A are sampled uniformly,
+                so the estimate targets the same accuracy. Only the
+                `ls_` and `sy_` words are tested, and no combined
+                result is reported. The intervals and trial counts
+                are added to the results. Cannot be used with
+                `use_noise_for_x`. (default = False)
+            seed : int, OPTIONAL
+                Seed of the trials. (default = None)
+            ci_width : float, OPTIONAL
+                Target width of the intervals. (default = 0.02)
+            max_trials : int, OPTIONAL
+                Maximum number of trials per dataset.
+                (default = 100000)
+            batch_size : int, OPTIONAL
+                Number of adaptive trials scored at once.
+            confidence : float, OPTIONAL
+                Confidence level of the Wilson score intervals.
+                (default = 0.95)
+        """
+        if embeddings is None:
+            embeddings = UtteranceEmbeddings(utterances, word_vec_fn)
+
+        counts = {
+            test_set: self._cross_word_counts(
+                utterances,
+                word_vec_fn,
+                embeddings,
+                test_set,
+                use_noise_for_x=use_noise_for_x,
+                adaptive=adaptive,
+                seed=seed,
+                ci_width=ci_width,
+                max_trials=max_trials,
+                batch_size=batch_size,
+                confidence=confidence
+            )
+            for test_set in self._cross_word_sets(adaptive)
         }
+        return self._cross_word_result(counts, adaptive, confidence)
 
     def run_suite(
             self,
             utterances: WordToUtteranceMapping,
             word_vec_fn: callable,
-            results_file: str = None
+            results_file: str = None,
+            embeddings_file: str = None,
+            seed: int = None,
+            adaptive: bool = False,
+            ci_width: float = 0.02,
+            max_trials: int = 100000,
+            n_workers: int = 1
     ) -> dict:
         """
         Runs all tests and saves to a results file.
@@ -367,25 +828,371 @@ class LSTestBench(TestBench):
                 File path to save results in. Saves it as a
                 JSON. Passing `None` will not save results
                 to a file.
+            embeddings_file : str, OPTIONAL
+                File to load the utterance embeddings from, or to
+                save them to after embedding every unique utterance
+                once. Passing `None` does not save them.
+            seed : int, OPTIONAL
+                Seed of the ABX trials. (default = None)
+            adaptive : bool, OPTIONAL
+                Whether to run the ABX tests until the confidence
+                interval of each test set is at most `ci_width`
+                wide, or `max_trials` trials have run. Their results
+                then also hold the interval and the number of trials
+                of each test set. (default = False)
+            ci_width : float, OPTIONAL
+                Target width of the ABX intervals. (default = 0.02)
+            max_trials : int, OPTIONAL
+                Maximum number of ABX trials per test set.
+                (default = 100000)
+            n_workers : int, OPTIONAL
+                Number of worker processes. With more than one, the
+                tests and the test sets within the ABX tests run
+                concurrently over embeddings in shared memory.
+                (default = 1)
         """
-        results = {
+        embeddings = UtteranceEmbeddings(
+            utterances, word_vec_fn, embeddings_file=embeddings_file
+        )
+        abx_args = {
+            "seed": seed,
+            "adaptive": adaptive,
+            "ci_width": ci_width,
+            "max_trials": max_trials
+        }
+        if n_workers > 1:
+            results = self._run_suite_parallel(
+                utterances, word_vec_fn, embeddings, n_workers, abx_args
+            )
+        else:
+            results = self._run_suite_serial(
+                utterances, word_vec_fn, embeddings, abx_args
+            )
+
+        if results_file is not None:
+            dump(results, open(results_file, "w+", encoding="utf-8"))
+
+        return results
+
+    def _run_suite_serial(
+            self,
+            utterances: WordToUtteranceMapping,
+            word_vec_fn: callable,
+            embeddings: UtteranceEmbeddings,
+            abx_args: dict
+    ) -> dict:
+        return {
             "similarities": self.similarity_score_test(
                 utterances=utterances,
-                word_vec_fn=word_vec_fn
+                word_vec_fn=word_vec_fn,
+                embeddings=embeddings
             ),
             "xw-abx-test": self.cross_word_abx_test(
                 utterances=utterances,
                 word_vec_fn=word_vec_fn,
-                use_noise_for_x=False
+                embeddings=embeddings,
+                use_noise_for_x=False,
+                **abx_args
             ),
             "sw-abx-test": self.same_word_abx_test(
                 utterances=utterances,
                 word_vec_fn=word_vec_fn,
-                use_noise_for_x=False
+                embeddings=embeddings,
+                use_noise_for_x=False,
+                **abx_args
+            )
+        }
+
+    def _run_suite_parallel(
+            self,
+            utterances: WordToUtteranceMapping,
+            word_vec_fn: callable,
+            embeddings: UtteranceEmbeddings,
+            n_workers: int,
+            abx_args: dict
+    ) -> dict:
+        """
+        Runs the similarity test and every test set of the ABX tests as
+        tasks of a process pool. The embeddings are moved into shared
+        memory, which the workers attach to once, and the counts of the
+        test sets are merged as in the serial tests.
+        """
+        embeddings.share()
+        try:
+            with ProcessPoolExecutor(
+                max_workers=n_workers,
+                initializer=_init_suite_worker,
+                initargs=(self, utterances, word_vec_fn, embeddings)
+            ) as pool:
+                similarities = pool.submit(
+                    _run_suite_task, "similarity_score_test", {}
+                )
+                cross_word = {
+                    test_set: pool.submit(
+                        _run_suite_task,
+                        "_cross_word_counts",
+                        {"test_set": test_set, **abx_args}
+                    )
+                    for test_set in self._cross_word_sets(
+                        abx_args["adaptive"]
+                    )
+                }
+                same_word = {
+                    test_set: pool.submit(
+                        _run_suite_task,
+                        "_same_word_counts",
+                        {"test_set": test_set, **abx_args}
+                    )
+                    for test_set in _SAME_WORD_SETS
+                }
+
+                return {
+                    "similarities": similarities.result(),
+                    "xw-abx-test": self._cross_word_result(
+                        {
+                            test_set: task.result()
+                            for test_set, task in cross_word.items()
+                        },
+                        abx_args["adaptive"]
+                    ),
+                    "sw-abx-test": self._abx_result(
+                        "Same-word ABX Result",
+                        {
+                            test_set: task.result()
+                            for test_set, task in same_word.items()
+                        },
+                        abx_args["adaptive"]
+                    )
+                }
+        finally:
+            embeddings.close()
+
+
+class HumanABXTestBench(TestBench):
+    """
+    Scores a model on the ABX triplets of a human ABX test. Every row
+    of the test file holds the test set, index and human answer of a
+    triplet, then its utterances A, B and X, where either B or X is
+    the utterance of A's word. The solutions file holds the correct
+    answer of every row, in the same order: "B" if it is B, "X" if it
+    is X. Columns are split on any whitespace, and the human answer
+    may be missing.
+
+    The utterances must be at the input of the level whose vector
+    function is tested.
+    """
+    def __init__(
+            self,
+            test_file: str = "human_abx_test/test_file.txt",
+            solutions_file: str = "human_abx_test/solutions.txt"
+    ) -> None:
+        self.load_scores(test_file, solutions_file)
+
+    def load_scores(
+            self,
+            test_file: str,
+            solutions_file: str
+    ):
+        """
+        Streams the triplets and their solutions into arrays. Every
+        unique utterance is stored once in `utterances`, and triplets
+        hold their indices. Header lines starting with "Test set" are
+        skipped.
+        """
+        self.test_sets = {}
+        self.utterances = {}
+        columns = {
+            name: []
+            for name in ["test_set", "a", "b", "x", "human", "solution"]
+        }
+
+        with open(test_file, "r", encoding="utf-8") as test_fp, \
+                open(solutions_file, "r", encoding="utf-8") as solutions_fp:
+            solutions = self._iter_rows(solutions_fp)
+            for line_no, fields in self._iter_rows(test_fp):
+                if len(fields) == 6:
+                    test_set, index, human, utt_a, utt_b, utt_x = fields
+                elif len(fields) == 5:
+                    test_set, index, utt_a, utt_b, utt_x = fields
+                    human = None
+                else:
+                    raise ValueError(
+                        f"{test_file}:{line_no}: expected 5 or 6 columns, "
+                        f"got {len(fields)}."
+                    )
+
+                _, solution = next(solutions, (None, None))
+                if solution is None or solution[:2] != [test_set, index]:
+                    raise ValueError(
+                        f"{solutions_file}: no solution for {test_set} "
+                        f"{index} at {test_file}:{line_no}."
+                    )
+
+                columns["test_set"].append(
+                    self.test_sets.setdefault(test_set, len(self.test_sets))
+                )
+                for name, utterance in zip("abx", [utt_a, utt_b, utt_x]):
+                    columns[name].append(
+                        self.utterances.setdefault(
+                            utterance, len(self.utterances)
+                        )
+                    )
+                columns["human"].append({"B": 1, "X": 0}.get(human, -1))
+                columns["solution"].append(solution[2] == "B")
+
+        self.triplets = {
+            "test_set": np.array(columns["test_set"], dtype=np.int32),
+            "a": np.array(columns["a"], dtype=np.int64),
+            "b": np.array(columns["b"], dtype=np.int64),
+            "x": np.array(columns["x"], dtype=np.int64),
+            # 1 for "B", 0 for "X", -1 without an answer
+            "human": np.array(columns["human"], dtype=np.int8),
+            "solution": np.array(columns["solution"], dtype=bool)
+        }
+
+    def _iter_rows(
+            self,
+            lines: Iterable[str]
+    ) -> Iterator[tuple[int, list[str]]]:
+        for line_no, line in enumerate(lines, start=1):
+            fields = line.split()
+            if fields and fields[:2] != ["Test", "set"]:
+                yield line_no, fields
+
+    def answer_triplets(
+            self,
+            word_vec_fn: callable,
+            embeddings_file: str = None,
+            batch_size: int = 65536
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Answers every triplet with the vectors of `word_vec_fn`: "B"
+        if A is closer to B than to X. Every unique utterance is
+        embedded once, and triplets are scored in batches of
+        `batch_size`. Returns whether each answer is "B", and whether
+        all its utterances could be embedded.
+        """
+        embeddings = UtteranceEmbeddings(
+            list(self.utterances), word_vec_fn, embeddings_file
+        )
+        normed = embeddings.normed
+        rows = {
+            name: embeddings.rows[self.triplets[name]]
+            for name in "abx"
+        }
+
+        answers = np.zeros(len(rows["a"]), dtype=bool)
+        for start in range(0, len(answers), batch_size):
+            row_a, row_b, row_x = (
+                rows[name][start:start + batch_size] for name in "abx"
             )
+            answers[start:start + batch_size] = _abx_correct(
+                normed, row_a, row_b, row_x
+            )
+
+        valid = embeddings.valid[rows["a"]] \
+            & embeddings.valid[rows["b"]] \
+            & embeddings.valid[rows["x"]]
+        return answers, valid
+
+    def run_suite(
+            self,
+            utterances: WordToUtteranceMapping = None,
+            word_vec_fn: callable = None,
+            results_file: str = None,
+            embeddings_file: str = None,
+            n_workers: int = 1
+    ) -> dict:
+        """
+        Answers every triplet and reports, per test set, the accuracy
+        of the model, its agreement with the human answers, the
+        accuracy of the human answers, the number of scored trials and
+        the number of triplets skipped as they could not be embedded.
+
+        Inputs
+        ------
+            utterances : WordToUtteranceMapping, OPTIONAL
+                Not used, as the triplets hold their utterances.
+            word_vec_fn : callable
+                A function that returns embeddings for a
+                string input.
+            results_file : str, OPTIONAL
+                File path to save results in. Saves it as a
+                JSON. Passing `None` will not save results
+                to a file.
+            embeddings_file : str, OPTIONAL
+                File to load the utterance embeddings from, or to
+                save them to after embedding.
+            n_workers : int, OPTIONAL
+                Not used, as the triplets are scored in one
+                vectorised pass.
+        """
+        answers, valid = self.answer_triplets(word_vec_fn, embeddings_file)
+        solutions = self.triplets["solution"]
+        human = self.triplets["human"]
+
+        def __rate(hits, mask):
+            total = int(np.count_nonzero(mask))
+            return int(np.count_nonzero(hits & mask)) / total \
+                if total else None
+
+        results = {
+            "Human ABX Result": {},
+            "human agreement": {},
+            "human accuracy": {},
+            "trials": {},
+            "errors": {}
         }
+        for test_set, test_set_id in self.test_sets.items():
+            in_set = self.triplets["test_set"] == test_set_id
+            scored = in_set & valid
+            answered = human != -1
+            results["Human ABX Result"][test_set] = __rate(
+                answers == solutions, scored
+            )
+            results["human agreement"][test_set] = __rate(
+                answers == (human == 1), scored & answered
+            )
+            results["human accuracy"][test_set] = __rate(
+                (human == 1) == solutions, in_set & answered
+            )
+            results["trials"][test_set] = int(np.count_nonzero(scored))
+            results["errors"][test_set] = int(
+                np.count_nonzero(in_set & ~valid)
+            )
 
         if results_file is not None:
             dump(results, open(results_file, "w+", encoding="utf-8"))
 
         return results
+
+
+_suite_worker = {}
+
+
+def _init_suite_worker(
+        test_bench: LSTestBench,
+        utterances: WordToUtteranceMapping,
+        word_vec_fn: callable,
+        embeddings: UtteranceEmbeddings
+) -> None:
+    _suite_worker["test_bench"] = test_bench
+    _suite_worker["utterances"] = utterances
+    _suite_worker["word_vec_fn"] = word_vec_fn
+    _suite_worker["embeddings"] = embeddings
+
+
+def _run_suite_task(
+        method: str,
+        kwargs: dict
+):
+    """
+    Runs a test bench method on the worker's utterances and shared
+    embeddings in a worker process.
+    """
+    return getattr(_suite_worker["test_bench"], method)(
+        utterances=_suite_worker["utterances"],
+        word_vec_fn=_suite_worker["word_vec_fn"],
+        embeddings=_suite_worker["embeddings"],
+        **kwargs
+    )
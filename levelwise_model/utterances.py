@@ -1,26 +1,234 @@
+from collections import deque
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from hashlib import sha256
+from io import StringIO
 from os import makedirs
 
+import numpy as np
 import sentencepiece as spm
 
 from levelwise_model.cluster import Cluster
-from typing import Union
+from levelwise_model.encoder import PieceEncoder
+from levelwise_model.level_encoder import LevelEncoder
+from typing import Iterator, Union
+
+
+# Word prefix of every dataset, indexed by dataset tag
+DATASET_PREFIXES = ["ls_", "sy_"]
+
+
+class UtteranceList(Sequence):
+    """
+    Read-only list of utterances over one or more ranges of utterance
+    indices of a mapping.
+    """
+    def __init__(
+            self,
+            mapping: "WordToUtteranceMapping",
+            ranges: list[tuple[int, int]]
+    ):
+        self.mapping = mapping
+        self.ranges = ranges
+
+    @property
+    def indices(self) -> np.ndarray:
+        """
+        Utterance indices of the list, for indexing per-utterance
+        arrays.
+        """
+        return np.concatenate(
+            [np.arange(start, end) for start, end in self.ranges]
+            or [np.zeros(0, dtype=np.int64)]
+        )
+
+    def __len__(self) -> int:
+        return sum(end - start for start, end in self.ranges)
+
+    def __getitem__(
+            self,
+            idx: Union[int, slice]
+    ) -> Union[str, list[str]]:
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        for start, end in self.ranges:
+            if 0 <= idx < end - start:
+                return self.mapping.get_utterance(start + idx)
+            idx -= end - start
+        raise IndexError("Utterance index out of range.")
+
+    def __iter__(self) -> Iterator[str]:
+        for start, end in self.ranges:
+            for idx in range(start, end):
+                yield self.mapping.get_utterance(idx)
+
+    def __eq__(self, other) -> bool:
+        return list(self) == list(other)
+
+
+class UtteranceView(Mapping):
+    """
+    Read-only word to utterances mapping over the store of a mapping.
+    Every key reads the utterances of one or more words.
+    """
+    def __init__(
+            self,
+            mapping: "WordToUtteranceMapping",
+            word_ids: dict[str, tuple[int, ...]]
+    ):
+        self.mapping = mapping
+        self.word_ids = word_ids
+
+    def __getitem__(
+            self,
+            word: str
+    ) -> UtteranceList:
+        offsets = self.mapping.word_offsets
+        return UtteranceList(
+            self.mapping,
+            [
+                (int(offsets[word_id]), int(offsets[word_id + 1]))
+                for word_id in self.word_ids[word]
+            ]
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.word_ids)
+
+    def __len__(self) -> int:
+        return len(self.word_ids)
+
+    def __contains__(self, word) -> bool:
+        return word in self.word_ids
 
 
 class WordToUtteranceMapping:
+    """
+    Mapping of words to their utterances, stored column-wise. Words are
+    kept once in `words`, with the dataset tag of every word in
+    `datasets`. The utterances of all words are concatenated, grouped
+    by word, in the single string `buffer`. `utterance_offsets` holds
+    the position of every utterance in it, and `word_offsets` the
+    first utterance index of every word.
+
+    `utterances`, `ls_utterances`, `sy_utterances` and
+    `mixed_utterances` are read-only dict-like views of the store.
+    """
     def __init__(
             self,
             utterances: Union[dict, str] = None,
     ):
-        self.utterances = {}
-        self.ls_utterances = {}
-        self.sy_utterances = {}
-        self.mixed_utterances = {}
+        self._clear()
         if isinstance(utterances, dict):
             self.load_from_dict(utterances)
         elif isinstance(utterances, str):
             self.load_from_file(utterances)
         self.split_utterances_by_dataset()
 
+    @property
+    def utterances(self) -> UtteranceView:
+        return self._views["all"]
+
+    @utterances.setter
+    def utterances(
+            self,
+            utterances: dict
+    ) -> None:
+        keys = []
+        seqs = []
+        for word, word_utterances in utterances.items():
+            keys.extend([word] * len(word_utterances))
+            seqs.extend(word_utterances)
+        self._clear()
+        self._build(keys, seqs)
+
+    def _clear(self) -> None:
+        self.words = []
+        self.word_index = {}
+        self.datasets = np.zeros(0, dtype=np.int8)
+        self.word_offsets = np.zeros(1, dtype=np.int64)
+        self.buffer = ""
+        self.utterance_offsets = np.zeros(1, dtype=np.int64)
+        self._views = {}
+
+    @property
+    def ls_utterances(self) -> UtteranceView:
+        return self._views["ls"]
+
+    @property
+    def sy_utterances(self) -> UtteranceView:
+        return self._views["sy"]
+
+    @property
+    def mixed_utterances(self) -> UtteranceView:
+        return self._views["mixed"]
+
+    def __len__(self) -> int:
+        return len(self.utterance_offsets) - 1
+
+    def get_utterance(
+            self,
+            idx: int
+    ) -> str:
+        return self.buffer[
+            self.utterance_offsets[idx]:self.utterance_offsets[idx + 1]
+        ]
+
+    def iter_utterances(self) -> Iterator[str]:
+        """
+        Yields all utterances in order, grouped by word.
+        """
+        buffer = self.buffer
+        offsets = self.utterance_offsets.tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield buffer[start:end]
+
+    def _set_buffer(
+            self,
+            utterances: list[str]
+    ) -> None:
+        self.buffer = "".join(utterances)
+        self.utterance_offsets = np.concatenate([
+            [0], np.cumsum([len(utterance) for utterance in utterances])
+        ]).astype(np.int64)
+
+    def _build(
+            self,
+            keys: list[str],
+            seqs: list[str]
+    ) -> None:
+        """
+        Appends utterances `seqs` of words `keys` to the store, keeping
+        the utterances of every word together and in order.
+        """
+        words = self.words + [
+            word for word in dict.fromkeys(keys)
+            if word not in self.word_index
+        ]
+        word_index = {word: idx for idx, word in enumerate(words)}
+
+        # Word of every stored utterance, followed by the new ones
+        word_ids = np.concatenate([
+            np.repeat(
+                np.arange(len(self.words), dtype=np.int64),
+                np.diff(self.word_offsets)
+            ),
+            np.array([word_index[key] for key in keys], dtype=np.int64)
+        ])
+        order = np.argsort(word_ids, kind="stable")
+        utterances = list(self.iter_utterances()) + seqs
+
+        self.words = words
+        self.word_index = word_index
+        self.word_offsets = np.concatenate([
+            [0], np.cumsum(np.bincount(word_ids, minlength=len(words)))
+        ]).astype(np.int64)
+        self._set_buffer([utterances[idx] for idx in order])
+        self.split_utterances_by_dataset()
+
     def load_from_dict(
             self,
             utterances: dict
@@ -28,45 +236,82 @@ class WordToUtteranceMapping:
         self.utterances = utterances
 
     def split_utterances_by_dataset(self) -> None:
-        for word in self.utterances:
-            if word.startswith("ls_"):
-                self.ls_utterances[word] = self.utterances[word]
-            if word.startswith("sy_"):
-                self.sy_utterances[word] = self.utterances[word]
-        for word in self.utterances:
-            if word[3:] not in self.mixed_utterances:
-                self.mixed_utterances[word[3:]] = []
-                if "ls_" + word[3:] in self.ls_utterances:
-                    self.mixed_utterances[word[3:]] = \
-                        self.mixed_utterances[word[3:]] + \
-                        self.ls_utterances["ls_" + word[3:]]
-                if "sy_" + word[3:] in self.sy_utterances:
-                    self.mixed_utterances[word[3:]] = \
-                        self.mixed_utterances[word[3:]] + \
-                        self.sy_utterances["sy_" + word[3:]]
+        """
+        Tags every word with its dataset and rebuilds the views. Words
+        of no dataset are tagged -1. Mixed utterances of a word are
+        its utterances from all datasets, keyed without the prefix.
+        """
+        self.datasets = np.full(len(self.words), -1, dtype=np.int8)
+        by_dataset = [{} for _ in DATASET_PREFIXES]
+        for word_id, word in enumerate(self.words):
+            for tag, prefix in enumerate(DATASET_PREFIXES):
+                if word.startswith(prefix):
+                    self.datasets[word_id] = tag
+                    by_dataset[tag][word] = (word_id,)
+
+        mixed = {}
+        for word in self.words:
+            if word[3:] not in mixed:
+                mixed[word[3:]] = tuple(
+                    self.word_index[prefix + word[3:]]
+                    for prefix in DATASET_PREFIXES
+                    if prefix + word[3:] in self.word_index
+                )
+
+        self._views = {
+            "all": UtteranceView(
+                self, {word: (idx,) for idx, word in enumerate(self.words)}
+            ),
+            "ls": UtteranceView(self, by_dataset[0]),
+            "sy": UtteranceView(self, by_dataset[1]),
+            "mixed": UtteranceView(self, mixed)
+        }
 
     def load_from_file(
             self,
-            map_file: str
+            map_file: str,
+            duplicate: bool = True
     ) -> None:
         """
         Loads mapping from a file with word and utterance separated by
         a tab-space.
+
+        Inputs
+        ------
+            map_file : str
+                Filepath of the mapping.
+            duplicate : bool, OPTIONAL
+                Whether to add every utterance twice. Files written by
+                `save_mapping` already contain the duplicates.
+                (default = True)
         """
+        keys = []
+        seqs = []
         with open(map_file, "r", encoding='utf-8') as utterance_file:
-            for line in utterance_file.readlines():
+            for line in utterance_file:
                 if line.strip():
                     key, seq = line.strip().split("\t")
+                    keys.append(key)
+                    seqs.append(seq)
 
-                    if key not in self.utterances:
-                        self.utterances[key] = []
+                    if not duplicate:
+                        continue
 
-                    self.utterances[key].append(seq)
+                    keys.append(key)
+                    seqs.append(seq)
 
-                    if key not in self.utterances:
-                        self.utterances[key] = []
+        self._build(keys, seqs)
 
-                    self.utterances[key].append(seq)
+    def get_hash(self) -> str:
+        """
+        Returns the SHA-256 hex digest of the mapping as `save_mapping`
+        would write it.
+        """
+        digest = sha256()
+        for word in self.utterances:
+            for utterance in self.utterances[word]:
+                digest.update((word + "\t" + utterance + "\n").encode())
+        return digest.hexdigest()
 
     def save_mapping(
             self,
@@ -84,49 +329,168 @@ class WordToUtteranceMapping:
 
     def update_utterances(
             self,
-            sp_model: spm.SentencePieceProcessor,
+            sp_model: Union[
+                spm.SentencePieceProcessor, PieceEncoder, LevelEncoder
+            ],
             clusters: Cluster
     ):
         """
         Updates utterances based on new tokenising and
         clustering.
         """
-        new_utterances = {}
-        for word in self.utterances:
-            new_utterances[word] = []
-            for utterance in self.utterances[word]:
-                pieces = list(
-                    filter(
-                        lambda x: x != "▁",
-                        sp_model.EncodeAsPieces(utterance)
-                    )
-                )
+        encoder = LevelEncoder.wrap(sp_model)
+        encoder.set_clusters(clusters)
+        self._set_buffer(
+            list(encoder.iter_encode_codes(self.iter_utterances()))
+        )
+
+    def update_utterances_parallel(
+            self,
+            sp_model_path: str,
+            cluster_file: str,
+            map_file: str = None,
+            n_workers: int = 4,
+            chunk_size: int = 10000
+    ):
+        """
+        Updates utterances like `update_utterances` in a process pool.
+        Words are split into chunks of about `chunk_size` utterances,
+        and every worker loads the SentencePiece model and the cluster
+        mapping once. Results are collected in order and, if `map_file`
+        is given, written to it as they arrive, in the format of
+        `save_mapping`.
+
+        Inputs
+        ------
+            sp_model_path : str
+                Path of the level's SentencePiece model.
+            cluster_file : str
+                Path of the level's cluster mapping, preferably saved
+                with its binary copy.
+            map_file : str, OPTIONAL
+                Filepath to write the updated mapping to.
+            n_workers : int, OPTIONAL
+                Number of worker processes. (default = 4)
+            chunk_size : int, OPTIONAL
+                Approximate number of utterances per chunk.
+                (default = 10000)
+        """
+        # First word of every chunk, cut at word boundaries
+        cuts = np.unique(np.concatenate([
+            np.searchsorted(
+                self.word_offsets,
+                np.arange(0, len(self), chunk_size),
+                side="right"
+            ) - 1,
+            [len(self.words)]
+        ]))
+        chunks = list(zip(cuts[:-1].tolist(), cuts[1:].tolist()))
+
+        # Chunks are written to the new buffer as they arrive, so only
+        # the chunks in flight are held besides the two buffers
+        buffer = StringIO()
+        lengths = []
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_init_update_worker,
+            initargs=(sp_model_path, cluster_file)
+        ) as pool, (
+            open(map_file, "w+", encoding="utf-8")
+            if map_file is not None else nullcontext()
+        ) as map_fp:
+            # Keep a bounded number of chunks in flight
+            pending = deque()
+            n_submitted = 0
+            for start_word, end_word in chunks:
+                while n_submitted < len(chunks) and \
+                        len(pending) < 2 * n_workers:
+                    first, last = self.word_offsets[list(chunks[n_submitted])]
+                    pending.append(pool.submit(
+                        _update_chunk,
+                        self.buffer[
+                            self.utterance_offsets[first]:
+                            self.utterance_offsets[last]
+                        ],
+                        np.diff(self.utterance_offsets[first:last + 1])
+                    ))
+                    n_submitted += 1
+
+                text, text_lengths = pending.popleft().result()
+                buffer.write(text)
+                lengths.append(text_lengths)
+                if map_fp is None:
+                    continue
 
-                units = [piece.replace("▁", "") for piece in pieces]
-                new_utterances[word].append("".join(
-                    clusters.word_to_cluster[piece] for piece in units
-                ))
+                text_offsets = np.concatenate(
+                    [[0], np.cumsum(text_lengths)]
+                ).tolist()
+                first = self.word_offsets[start_word]
+                for word_id in range(start_word, end_word):
+                    word = self.words[word_id]
+                    for idx in range(
+                        self.word_offsets[word_id] - first,
+                        self.word_offsets[word_id + 1] - first
+                    ):
+                        map_fp.write(
+                            word + "\t"
+                            + text[text_offsets[idx]:text_offsets[idx + 1]]
+                            + "\n"
+                        )
 
-        self.utterances = new_utterances
+        self.buffer = buffer.getvalue()
+        buffer.close()
+        lengths = np.concatenate(lengths or [np.zeros(0, dtype=np.int64)])
+        self.utterance_offsets = np.concatenate(
+            [[0], np.cumsum(lengths)]
+        ).astype(np.int64)
 
     def get_utterance_stats(
             self,
-            sp_model: spm.SentencePieceProcessor
+            sp_model: Union[
+                spm.SentencePieceProcessor, PieceEncoder, LevelEncoder
+            ]
     ):
+        lines = LevelEncoder.wrap(sp_model).iter_encode_ids(
+            self.iter_utterances()
+        )
+
         utterance_lengths = {}
         all_lengths = []
         for word in self.utterances:
-            utterance_lengths[word] = []
-            for utterance in self.utterances[word]:
-                pieces = list(
-                    filter(
-                        lambda x: x != "▁",
-                        sp_model.EncodeAsPieces(utterance)
-                    )
-                )
-
-                units = [piece.replace("▁", "") for piece in pieces]
-                utterance_lengths[word].append(len(units))
-                all_lengths.append(len(units))
+            utterance_lengths[word] = [
+                len(next(lines)) for _ in self.utterances[word]
+            ]
+            all_lengths.extend(utterance_lengths[word])
 
         return utterance_lengths, all_lengths
+
+
+# Encoder of an utterance update worker process
+_update_worker = {}
+
+
+def _init_update_worker(
+        sp_model_path: str,
+        cluster_file: str
+) -> None:
+    sp_model = spm.SentencePieceProcessor()
+    sp_model.load(sp_model_path)
+    _update_worker["encoder"] = LevelEncoder(
+        PieceEncoder(sp_model, n_workers=1),
+        clusters=Cluster(map_file=cluster_file)
+    )
+
+
+def _update_chunk(
+        text: str,
+        lengths: np.ndarray
+) -> tuple[str, np.ndarray]:
+    """
+    Rewrites a chunk of concatenated utterances in a worker process.
+    Returns the concatenated cluster key strings and their lengths.
+    """
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).tolist()
+    codes = _update_worker["encoder"].encode_codes([
+        text[start:end] for start, end in zip(offsets[:-1], offsets[1:])
+    ])
+    return "".join(codes), np.array([len(code) for code in codes])
@@ -0,0 +1,70 @@
+"""
+This module contains the vector function of a trained level.
+"""
+import numpy as np
+import sentencepiece as spm
+from gensim.models import KeyedVectors
+
+from levelwise_model.encoder import PieceEncoder
+from levelwise_model.level_encoder import LevelEncoder
+
+
+class LevelVectorizer:
+    """
+    Generates vectors for an input at a given level. Only the path of
+    the SentencePiece model and the Word2Vec vectors are kept, so the
+    function can be pickled and sent to other processes.
+    """
+    def __init__(
+            self,
+            sp_model_path: str,
+            keyed_vectors: KeyedVectors,
+            encoder: LevelEncoder = None
+    ):
+        """
+        Inputs
+        ------
+            sp_model_path : str
+                Path of the level's SentencePiece model.
+            keyed_vectors : KeyedVectors
+                Vectors of the level's Word2Vec model.
+            encoder : LevelEncoder, OPTIONAL
+                Already loaded encoder of the level, whose cache is
+                shared with the utterance update. It is rebuilt from
+                `sp_model_path`, with an empty cache, after unpickling.
+        """
+        self.sp_model_path = sp_model_path
+        self.wv = keyed_vectors
+        self._encoder = encoder
+
+    @property
+    def encoder(self) -> LevelEncoder:
+        if self._encoder is None:
+            sp_model = spm.SentencePieceProcessor()
+            sp_model.load(self.sp_model_path)
+            self._encoder = LevelEncoder(
+                PieceEncoder(sp_model, n_workers=1),
+                keyed_vectors=self.wv
+            )
+        return self._encoder
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_encoder"] = None
+        return state
+
+    def __call__(
+            self,
+            word: str
+    ) -> np.ndarray:
+        return self.encoder.vector(word)
+
+    def embed(
+            self,
+            words: list[str]
+    ) -> np.ndarray:
+        """
+        Returns the vectors of a batch of inputs as the rows of a
+        (number of inputs, vector size) array.
+        """
+        return self.encoder.vectors(words)